@@ -2,34 +2,113 @@ import math
 import random
 
 import numpy as np
-from direct.interval.IntervalGlobal import Sequence, Parallel, Func
-from panda3d.core import NodePath
+from direct.interval.IntervalGlobal import Parallel, Func
+from panda3d.core import NodePath, ConfigVariableBool
 from panda3d.core import Vec3, BitMask32, Point3
 from panda3d.bullet import BulletRigidBodyNode, BulletSphereShape
 
 from bubble import Bubbles
 from tower import Colors
 from create_geomnode import SphereGeom
+from prototypes import prototypes
 
 
 PATH_TEXTURE_MULTI = 'textures/multi.jpg'
 PATH_TEXTURE_TWOTONE = 'textures/two_tone.jpg'
 
 
+ball_constant_speed = ConfigVariableBool(
+    'ball-constant-speed', False,
+    'If True, the thrown ball flies along its curve at a constant speed.')
+
+
+class BezierPath:
+    """A path of Bezier curves sampled once into a table, so that a point on it is
+       found by a lookup and a linear interpolation.
+       Args:
+            segments (list): the control points of each curve; a curve can be of any degree,
+                             and each one starts at the end of the previous one;
+            samples (int): the number of points sampled per curve;
+            constant_speed (bool): if True, t is proportional to the arc length;
+    """
+
+    def __init__(self, segments, samples=64, constant_speed=False):
+        self.segments = [np.array(pts, dtype=np.float64) for pts in segments]
+        n = len(self.segments) * samples + 1
+        u = np.linspace(0, 1, n)
+
+        if constant_speed:
+            # The arc length at each u; then find the u at even intervals of it.
+            pts = self.evaluate(u)
+            lengths = np.concatenate(([0], np.cumsum(np.linalg.norm(np.diff(pts, axis=0), axis=1))))
+            u = np.interp(np.linspace(0, lengths[-1], n), lengths, u)
+
+        self.table = self.evaluate(u)
+        self.last = n - 1
+
+    def evaluate(self, u):
+        """Return the points at the parameters u from 0 to 1 over the whole path.
+        """
+        cnt = len(self.segments)
+        idx = np.minimum((u * cnt).astype(int), cnt - 1)
+        t = u * cnt - idx
+        pts = np.empty((len(u), 3))
+
+        for i, ctrl in enumerate(self.segments):
+            mask = idx == i
+            pts[mask] = self.bernstein(len(ctrl) - 1, t[mask]) @ ctrl
+
+        return pts
+
+    @staticmethod
+    def bernstein(n, t):
+        """Return the Bernstein basis of degree n at t, as a matrix of len(t) x (n + 1).
+        """
+        k = np.arange(n + 1)
+        coef = np.array([math.comb(n, i) for i in k])
+        return coef * t[:, None] ** k * (1 - t[:, None]) ** (n - k)
+
+    def get_point(self, t):
+        """t (float): from 0 to 1;
+        """
+        f = min(max(t, 0), 1) * self.last
+        i = min(int(f), self.last - 1)
+        r = f - i
+        (x0, y0, z0), (x1, y1, z1) = self.table[i:i + 2].tolist()
+
+        return Point3(x0 + (x1 - x0) * r, y0 + (y1 - y0) * r, z0 + (z1 - z0) * r)
+
+
 class ColorBall:
 
-    def __init__(self, world):
+    def __init__(self):
         self.bubbles = Bubbles()
         self.ball = None
+        self.kind = None
+        # If True, the ball flies along the curve at a constant speed.
+        self.constant_speed = ball_constant_speed.get_value()
 
         self.normal_ball = NormalBall()
-        world.attach(self.normal_ball.node())
-
         self.multi_ball = MultiColorBall()
-        world.attach(self.multi_ball.node())
-
         self.twotone_ball = TwoToneBall()
-        world.attach(self.twotone_ball.node())
+
+    def attach(self, world):
+        """Attach the balls to the world at the origin, so that where they were thrown
+           in the last world makes no difference to the new one.
+        """
+        if self.ball is not None and self.ball.has_parent():
+            self.detach_ball()
+
+        for ball in (self.normal_ball, self.multi_ball, self.twotone_ball):
+            # Moved as a kinematic body, Bullet would still keep where it was thrown to give it a velocity.
+            ball.node().set_kinematic(False)
+            ball.set_pos_hpr(0, 0, 0, 0, 0, 0)
+            ball.node().set_kinematic(True)
+            world.attach(ball.node())
+
+    def detach(self, world):
+        for ball in (self.normal_ball, self.multi_ball, self.twotone_ball):
+            world.remove(ball.node())
 
     def initialize(self, tower):
         if self.ball is not None and self.ball.has_parent():
@@ -37,10 +116,21 @@ class ColorBall:
         self.tower = tower
         self.twotone_used = False
 
-    def setup(self, pos, parent):
-        b = 7 if not self.twotone_used else 6
+    def setup(self, pos, parent, kind=None):
+        """Args:
+                pos (Point3): the position relative to the parent;
+                parent (NodePath)
+                kind (int): 0 to 5 for a normal ball of the color, 6 and 7 for the multi colored and two tone balls;
+                            if None, chosen at random;
+        """
+        if self.ball is not None and self.ball.has_parent():
+            self.detach_ball()
+
+        if kind is None:
+            kind = random.randint(0, 7 if not self.twotone_used else 6)
+        self.kind = kind
 
-        match n := random.randint(0, b):
+        match kind:
             case 6:
                 self.ball = self.multi_ball
             case 7:
@@ -48,8 +138,8 @@ class ColorBall:
                 self.ball = self.twotone_ball
             case _:
                 self.ball = self.normal_ball
-                color = Colors.get_rgba(n)
-                self.ball.set_color(color)
+                self.ball.color_id = Colors(kind)
+                self.ball.set_color(self.ball.color_id.rgba)
 
         self.ball.set_pos(pos)
         self.ball.set_hpr(Vec3(95, 0, 30))
@@ -61,6 +151,7 @@ class ColorBall:
     def aim_at(self, clicked_pt, block):
         self.target_pt = clicked_pt
         self.target_block = block
+        self.target_color = self.tower.get_color(block)
 
         start_pt = self.ball.get_pos()
         end_pt = self.ball.get_parent().get_relative_point(base.render, clicked_pt)
@@ -68,31 +159,15 @@ class ColorBall:
         mid = (start_pt + end_pt) / 2
         mid.z += 10
 
-        self.control_pts = [start_pt, mid, end_pt]
+        self.path = BezierPath([[start_pt, mid, end_pt]], constant_speed=self.constant_speed)
         self.total_dt = 0
 
-    def bernstein(self, n, k, t):
-        coef = math.factorial(n) / (math.factorial(k) * math.factorial(n - k))
-        return coef * t ** k * (1 - t) ** (n - k)
-
-    def bezier_curve(self, dt):
-        n = len(self.control_pts) - 1
-        px = py = pz = 0
-
-        for i in range(len(self.control_pts)):
-            b = self.bernstein(n, i, self.total_dt)
-            px += np.dot(b, self.control_pts[i][0])
-            py += np.dot(b, self.control_pts[i][1])
-            pz += np.dot(b, self.control_pts[i][2])
-
-        return Point3(px, py, pz)
-
     def move(self, dt):
         self.total_dt += dt
         if self.total_dt > 1:
             self.total_dt = 1
 
-        pt = self.bezier_curve(dt)
+        pt = self.path.get_point(self.total_dt)
         self.ball.set_pos(pt)
         self.ball.set_p(self.ball.get_p() + 360 * dt)
 
@@ -102,14 +177,14 @@ class ColorBall:
 
     def hit(self):
         self.detach_ball()
-        self.ball.hit(self.target_pt, self.target_block, self.bubbles, self.tower)
+        self.ball.hit(self.target_pt, self.target_block, self.target_color, self.bubbles, self.tower)
 
 
 class Balls(NodePath):
 
     def __init__(self, name):
         super().__init__(BulletRigidBodyNode(name))
-        self.model = SphereGeom(radius=2.0)
+        self.model = prototypes.get_model(SphereGeom, radius=2.0)
         self.model.reparent_to(self)
         end, tip = self.model.get_tight_bounds()
         size = tip - end
@@ -123,20 +198,18 @@ class NormalBall(Balls):
 
     def __init__(self):
         super().__init__('normal_ball')
+        self.color_id = None
 
-    def hit(self, clicked_pos, block, bubbles, tower):
+    def hit(self, clicked_pos, block, color, bubbles, tower):
         blocks = []
-        if self.getColor() == block.get_color():
-            tower.get_neighbors(block, block.get_color(), blocks)
+        if self.color_id == color:
+            blocks = tower.get_neighbors(block, color)
 
-        para = Parallel(bubbles.get_sequence(self.get_color(), clicked_pos))
+        rgba = self.color_id.rgba
+        para = Parallel(bubbles.get_sequence(rgba, clicked_pos), Func(tower.remove_blocks, blocks))
 
-        for block in blocks:
-            pos = block.get_pos(base.render)
-            para.append(Sequence(
-                Func(tower.clean_up, block),
-                bubbles.get_sequence(self.get_color(), pos))
-            )
+        for pos in tower.get_positions(blocks):
+            para.append(bubbles.get_sequence(rgba, pos))
         para.start()
 
 
@@ -146,17 +219,16 @@ class MultiColorBall(Balls):
         super().__init__('multicolor_ball')
         self.model.set_texture(base.loader.load_texture(PATH_TEXTURE_MULTI), 1)
 
-    def _hit(self, color, bubbles, tower):
-        for block in tower.judge_colors(lambda x: x.get_color() == color):
-            pos = block.get_pos(base.render)
-            yield Sequence(Func(tower.clean_up, block),
-                           bubbles.get_sequence(color, pos))
+    def _hit(self, blocks, color, bubbles, tower):
+        for pos in tower.get_positions(blocks):
+            yield bubbles.get_sequence(color.rgba, pos)
 
-    def hit(self, clicked_pos, block, bubbles, tower):
-        color = block.get_color()
+    def hit(self, clicked_pos, block, color, bubbles, tower):
+        blocks = tower.judge_colors(lambda x: x == color)
         Parallel(
-            bubbles.get_sequence(color, clicked_pos),
-            *[seq for seq in self._hit(color, bubbles, tower)]
+            bubbles.get_sequence(color.rgba, clicked_pos),
+            Func(tower.remove_blocks, blocks),
+            *[seq for seq in self._hit(blocks, color, bubbles, tower)]
         ).start()
 
 
@@ -166,16 +238,15 @@ class TwoToneBall(Balls):
         super().__init__('twotone_ball')
         self.model.set_texture(base.loader.load_texture(PATH_TEXTURE_TWOTONE), 1)
 
-    def _hit(self, color, bubbles, tower):
-        for block in tower.judge_colors(lambda x: x.get_color() != color):
-            pos = block.get_pos(base.render)
-            color = block.get_color()
-            yield Sequence(Func(tower.clean_up, block),
-                           bubbles.get_sequence(color, pos))
+    def _hit(self, blocks, color, bubbles, tower):
+        for block, pos in zip(blocks, tower.get_positions(blocks)):
+            block_color = tower.get_color(block)
+            yield bubbles.get_sequence(block_color.rgba, pos)
 
-    def hit(self, clicked_pos, block, bubbles, tower):
-        color = block.get_color()
+    def hit(self, clicked_pos, block, color, bubbles, tower):
+        blocks = tower.judge_colors(lambda x: x != color)
         Parallel(
             bubbles.get_sequence(Colors.random_select(), clicked_pos),
-            *[seq for seq in self._hit(color, bubbles, tower)]
+            Func(tower.remove_blocks, blocks),
+            *[seq for seq in self._hit(blocks, color, bubbles, tower)]
         ).start()
@@ -0,0 +1,137 @@
+import hashlib
+import inspect
+import os
+
+from panda3d.core import ConfigVariableBool, ConfigVariableFilename
+from panda3d.core import Filename, NodePath, VirtualFileSystem, get_model_path
+
+
+cache_enabled = ConfigVariableBool(
+    'bam-cache', True,
+    'If True, the generated geoms and the converted models are kept in bam files.')
+
+cache_dir = ConfigVariableFilename(
+    'bam-cache-dir', 'cache',
+    'The directory where the bam files are written.')
+
+
+# the directory of the repository; the sources are keyed by their paths relative to it.
+REPO_DIR = Filename.from_os_specific(os.path.dirname(os.path.abspath(__file__)))
+
+
+def geom_params(geom_cls, params):
+    """Return the arguments of geom_cls with the defaults filled in, sorted by name (tuple),
+       so that the calls making the same geom have the same key.
+    """
+    args = inspect.signature(geom_cls).bind(**params)
+    args.apply_defaults()
+    return tuple(sorted(args.arguments.items()))
+
+
+class BamCache:
+    """Keep the generated geom nodes and the models converted from egg files in bam files,
+       named by a hash of the parameters and the source path, and a hash of the contents of the source.
+       A bam file made from an older source is deleted when the new one is written.
+    """
+
+    def __init__(self):
+        self.vfs = VirtualFileSystem.get_global_ptr()
+        self.hits = 0
+        self.misses = 0
+        # the full path of a source -> the hash of its contents.
+        self.digests = {}
+
+    @property
+    def root(self):
+        root = Filename(cache_dir.get_value())
+        root.make_absolute()
+        return root
+
+    def get_digest(self, source):
+        if (digest := self.digests.get(fullpath := source.get_fullpath())) is None:
+            data = self.vfs.read_file(source, True) if self.vfs.exists(source) else b''
+            digest = self.digests[fullpath] = hashlib.sha1(data).hexdigest()
+        return digest
+
+    def get_path(self, name, params, source):
+        """Return the path of the bam file.
+           Args:
+                name (str): the name of the generator or the model;
+                params (tuple): the parameters which the node is made from;
+                source (Filename): the source file; its path relative to the repository
+                                   and the hash of its contents are parts of the name;
+        """
+        relative = Filename(source)
+        relative.make_absolute()
+        relative.make_relative_to(REPO_DIR)
+        key = hashlib.sha1(repr((name, params, relative.get_fullpath())).encode()).hexdigest()
+        return Filename(self.root, f'{name}_{key[:16]}_{self.get_digest(source)[:8]}.bam')
+
+    def prune(self, path):
+        """Delete the bam files of the same name and parameters made from other versions of the source.
+        """
+        basename = path.get_basename()
+        prefix = basename[:basename.rindex('_') + 1]
+
+        if (files := self.vfs.scan_directory(self.root)) is not None:
+            for file in files:
+                if (name := file.get_filename().get_basename()) != basename and name.startswith(prefix):
+                    self.vfs.delete_file(file.get_filename())
+
+    def load(self, path, make):
+        """Return the node read from the bam file; if it does not exist, make and write it.
+        """
+        if self.vfs.exists(path):
+            try:
+                node = base.loader.load_model(path, noCache=True).node()
+                self.hits += 1
+                return node
+            except IOError:
+                pass
+
+        node = make()
+        self.misses += 1
+        self.vfs.make_directory_full(self.root)
+        self.prune(path)
+        NodePath(node).write_bam_file(path)
+        return node
+
+    def load_geom(self, geom_cls, **params):
+        """Return the geom node which geom_cls makes with the params (GeomNode).
+        """
+        def make():
+            return geom_cls(**params).node()
+
+        if not cache_enabled.get_value():
+            return make()
+
+        source = Filename.from_os_specific(inspect.getfile(geom_cls))
+        path = self.get_path(geom_cls.__name__, geom_params(geom_cls, params), source)
+        return self.load(path, make)
+
+    def load_model(self, model_path):
+        """Return the model loaded from the egg file, or from its bam file (NodePath).
+        """
+        def make():
+            return base.loader.load_model(model_path, noCache=True).node()
+
+        source = Filename(model_path)
+        if not source.get_extension():
+            source.set_extension('egg')
+
+        if not cache_enabled.get_value() or not self.vfs.resolve_filename(source, get_model_path().get_value()):
+            return NodePath(make())
+
+        path = self.get_path(source.get_basename_wo_extension(), (), source)
+        return NodePath(self.load(path, make))
+
+    def clear(self):
+        """Delete all the bam files in the cache directory.
+        """
+        if (files := self.vfs.scan_directory(self.root)) is not None:
+            for file in files:
+                if file.get_filename().get_extension() == 'bam':
+                    self.vfs.delete_file(file.get_filename())
+
+
+bam_cache = BamCache()
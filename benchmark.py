@@ -0,0 +1,201 @@
+"""Play every tower without a window and write the time taken by each stage of every frame to a JSON report.
+
+    python benchmark.py --seed 0 --frames 1800 --output benchmark.json
+"""
+import argparse
+import functools
+import json
+import random
+import time
+
+import numpy as np
+from panda3d.core import load_prc_file_data, ClockObject
+from panda3d.core import Point2
+
+# the quality governor is off, so that the frames are not changed by how fast the machine runs them.
+load_prc_file_data("", """
+    window-type none
+    audio-library-name null
+    quality-governor false""")
+
+from direct.showbase.ShowBaseGlobal import globalClock
+from bam_cache import bam_cache
+from prototypes import prototypes
+from towercrash import TowerCrash, Game
+from tower import towers
+
+
+# (camera heading, mouse x, mouse y); clicks are repeated in this order.
+CLICKS = [
+    (0, 0.0, 0.3), (90, 0.02, 0.4), (180, -0.02, 0.2), (270, 0.0, 0.35),
+    (45, 0.03, 0.25), (135, -0.03, 0.3), (225, 0.0, 0.15), (315, 0.02, 0.45),
+]
+
+
+class HeadlessGame:
+    """Drive TowerCrash without a window, with a fixed time step and a seeded RNG.
+       Args:
+            seed (int): the seed of the random module;
+            dt (float): the time step of a frame;
+            settle (int): the number of frames to wait after a ball has hit the tower;
+    """
+
+    def __init__(self, seed=0, dt=1 / 60, settle=60):
+        self.seed = seed
+        self.settle = settle
+        self.dt = dt
+        # whether the throw requested last has thrown a ball.
+        self.thrown = False
+        random.seed(seed)
+
+        start = time.perf_counter()
+        self.game = TowerCrash()
+        # cold if the bam files had to be written, warm if all of them were read.
+        self.startup = {
+            'seconds': time.perf_counter() - start,
+            'cache': 'warm' if not bam_cache.misses else 'cold',
+            'bam_hits': bam_cache.hits,
+            'bam_misses': bam_cache.misses,
+        }
+        globalClock.set_mode(ClockObject.M_non_real_time)
+        globalClock.set_frame_rate(1 / dt)
+
+    def start_tower(self, tower_num):
+        """Build the tower and skip the intro, so that the first frame is already playable.
+        """
+        game = self.game
+        random.seed(self.seed)
+        game.tower.remove_all_blocks()
+        game.tower_num = tower_num
+        game.start_new_game()
+        self.skip_intro()
+
+    def skip_intro(self):
+        """Put the game started by start_new_game in PLAY, as it is after the intro;
+           a recorded session is marked so that its replay skips the intro too.
+        """
+        game = self.game
+        if game.session_recorder is not None:
+            game.session_recorder.skip_intro()
+
+        game.start_screen.alpha = 0.0
+        game.start_screen.tear_down()
+        game.navigator.set_h(360)
+        game.navigator.set_z(game.camera_highest_z)
+        game.setup_ball()
+        game.state = Game.PLAY
+
+    def request_throw(self, throw):
+        """Have the next frame call throw where it takes a click, so that a recorded session replays the same;
+           throw returns True if it has thrown a ball, which is kept in self.thrown after the frame.
+        """
+        def call():
+            self.thrown = throw()
+
+        self.thrown = False
+        self.game.request(call)
+
+    def click(self, heading, x, y):
+        """Have the next frame turn the camera to the heading and click the point of the screen.
+        """
+        game = self.game
+        game.request(functools.partial(game.navigator.set_h, heading))
+        self.request_throw(lambda: game.throw_ball(*game.get_ray(Point2(x, y))))
+
+    def step(self):
+        """Run one frame, and return its stage timings in milliseconds, the number of physics steps
+           and the milliseconds of simulation dropped at the substep cap.
+        """
+        start = time.perf_counter()
+        self.game.taskMgr.step()
+        frame = {k: v * 1000 for k, v in self.game.timer.last.items()}
+        frame['frame'] = (time.perf_counter() - start) * 1000
+        frame['substeps'] = self.game.physics.substeps
+        frame['dropped'] = self.game.physics.dropped * 1000
+        frame['culled'] = self.game.culled.last
+        return frame
+
+    def play(self, tower_num, clicks, max_frames):
+        """Play one tower with the clicks until the game is over or max_frames have run.
+        """
+        game = self.game
+        made = prototypes.made
+        self.start_tower(tower_num)
+        frames = []
+        thrown = missed = 0
+        culled = game.culled.total
+        wait = self.settle
+
+        while len(frames) < max_frames and game.state != Game.GAMEOVER:
+            if clicked := game.state == Game.PLAY and (wait := wait - 1) <= 0:
+                self.click(*clicks[(thrown + missed) % len(clicks)])
+            frames.append(self.step())
+
+            if clicked:
+                if self.thrown:
+                    thrown += 1
+                    wait = self.settle
+                else:
+                    missed += 1
+
+        return {
+            'frames': frames,
+            'summary': summarize(frames),
+            'balls_thrown': thrown,
+            'clicks_missed': missed,
+            'tower_top': game.tower.tower_top,
+            'blocks_left': len(game.tower.block_index),
+            'culled_per_second': (game.culled.total - culled) / (len(frames) * self.dt),
+            # the geoms and shapes which the tower could not take from the prototype cache.
+            'prototypes_made': prototypes.made - made,
+        }
+
+
+def summarize(frames):
+    """Return mean, p50, p95 and max of every value of the frames.
+    """
+    summary = {}
+
+    for stage in {k for frame in frames for k in frame}:
+        values = np.array([frame.get(stage, 0) for frame in frames])
+        summary[stage] = {
+            'mean': float(values.mean()),
+            'p50': float(np.percentile(values, 50)),
+            'p95': float(np.percentile(values, 95)),
+            'max': float(values.max()),
+        }
+
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the towers without a window.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--frames', type=int, default=1800, help='the maximum number of frames per tower')
+    parser.add_argument('--dt', type=float, default=1 / 60)
+    parser.add_argument('--towers', nargs='*', help='the class names of the towers; all towers by default')
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--clear-cache', action='store_true', help='delete the bam files to measure a cold start')
+    args = parser.parse_args()
+
+    if args.clear_cache:
+        bam_cache.clear()
+
+    runner = HeadlessGame(args.seed, args.dt)
+    report = {'seed': args.seed, 'dt': args.dt, 'startup': runner.startup, 'towers': {}}
+    print(f"startup: {runner.startup['seconds']:.3f} s ({runner.startup['cache']})")
+
+    for i, tower in enumerate(towers):
+        if args.towers and tower.__name__ not in args.towers:
+            continue
+        result = runner.play(i, CLICKS, args.frames)
+        report['towers'][tower.__name__] = result
+        print(f"{tower.__name__}: {len(result['frames'])} frames, "
+              f"{result['balls_thrown']} balls, frame p95 {result['summary']['frame']['p95']:.2f} ms")
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+import itertools
+
+import numpy as np
+
+
+class BlockTable:
+    """Keep the state of the blocks of a tower in NumPy arrays, one slot a block,
+       so that the game can ask about many blocks at once instead of asking Bullet one by one.
+       The moving blocks are read from Bullet in bulk by refresh() once a frame, after the physics.
+       Args:
+            capacity (int): the initial number of the blocks;
+    """
+
+    def __init__(self, capacity=256):
+        self.blocks = []
+        self.nodes = []
+        self.slots = {}
+        # the prototype names, the radius of the bounding sphere of each,
+        # and the index of each block's prototype in them.
+        self.names = []
+        self.radii = []
+        # the slots read by the last refresh.
+        self.moving = np.zeros(0, dtype=np.int64)
+        self.size = 0
+        self.resize(capacity)
+
+    def resize(self, capacity):
+        arrays = dict(
+            pos=np.zeros((capacity, 3), dtype=np.float32),
+            quat=np.zeros((capacity, 4), dtype=np.float32),
+            prev_pos=np.zeros((capacity, 3), dtype=np.float32),
+            prev_quat=np.zeros((capacity, 4), dtype=np.float32),
+            scale=np.zeros((capacity, 3), dtype=np.float32),
+            radius=np.zeros(capacity, dtype=np.float32),
+            kind=np.zeros(capacity, dtype=np.int16),
+            row=np.zeros(capacity, dtype=np.int16),
+            col=np.zeros(capacity, dtype=np.int16),
+            color=np.zeros(capacity, dtype=np.int8),
+            awake=np.zeros(capacity, dtype=bool),
+            alive=np.zeros(capacity, dtype=bool),
+        )
+
+        for name, array in arrays.items():
+            if (old := getattr(self, name, None)) is not None:
+                array[:self.size] = old[:self.size]
+            setattr(self, name, array)
+
+    def add(self, block, row, col, color):
+        """Args:
+                block (NodePath): the rigid body of the block;
+                row (int), col (int): the place in the tower;
+                color (Colors)
+        """
+        if (i := self.size) == len(self.alive):
+            self.resize(i * 2)
+
+        if (name := block.get_name()) not in self.names:
+            self.names.append(name)
+            self.radii.append(self.get_radius(block))
+
+        self.blocks.append(block)
+        self.nodes.append(block.node())
+        self.slots[block.node()] = i
+        self.size += 1
+
+        transform = block.get_transform()
+        self.pos[i] = self.prev_pos[i] = transform.get_pos()
+        self.quat[i] = self.prev_quat[i] = transform.get_quat()
+        self.scale[i] = transform.get_scale()
+        self.kind[i] = kind = self.names.index(name)
+        self.radius[i] = self.radii[kind]
+        self.row[i] = row
+        self.col[i] = col
+        self.color[i] = color
+        self.alive[i] = True
+
+    @staticmethod
+    def get_radius(block):
+        """Return the radius of the sphere around the center of the block holding its model.
+           The model is measured, because some blocks scale their model instead of their body.
+        """
+        min_pt, max_pt = block.get_tight_bounds(block)
+        corner = np.maximum(np.abs(np.array(min_pt)), np.abs(np.array(max_pt))) * np.array(block.get_scale())
+        return float(np.linalg.norm(corner))
+
+    def wake(self, block, color):
+        """Mark the block as moving with the color.
+        """
+        i = self.slots[block.node()]
+        self.color[i] = color
+        self.awake[i] = True
+
+    def sleep(self, block, color):
+        """Mark the block as not moving with the color.
+        """
+        i = self.slots[block.node()]
+        self.color[i] = color
+        self.awake[i] = False
+
+    def revive(self, block, color):
+        """Mark the killed block as live again; block is a new NodePath of its node.
+        """
+        i = self.slots[block.node()]
+        self.blocks[i] = block
+        self.color[i] = color
+        self.alive[i] = True
+
+    def load(self, pos, quat, color):
+        """Overwrite the states of all the blocks, as if they had not moved in the last physics step.
+        """
+        n = self.size
+        self.pos[:n] = self.prev_pos[:n] = pos
+        self.quat[:n] = self.prev_quat[:n] = quat
+        self.color[:n] = color
+
+    def kill(self, block):
+        i = self.slots[block.node()]
+        self.alive[i] = False
+        self.awake[i] = False
+
+    def get_slots(self, blocks):
+        return np.array([self.slots[block.node()] for block in blocks], dtype=np.int64)
+
+    def read(self, slots):
+        """Return the positions and quaternions of the blocks read from their nodes.
+        """
+        nodes = self.nodes
+        values = np.fromiter(
+            itertools.chain.from_iterable(
+                [(*(ts := nodes[i].get_transform()).get_pos(), *ts.get_quat()) for i in slots]),
+            dtype=np.float32,
+            count=len(slots) * 7
+        ).reshape(-1, 7)
+
+        return values[:, :3], values[:, 3:]
+
+    def keep_previous(self):
+        """Keep the states of the moving blocks before the last physics step.
+        """
+        slots = np.flatnonzero(self.awake)
+        self.prev_pos[slots], self.prev_quat[slots] = self.read(slots)
+
+    def refresh(self):
+        """Read the states of the moving blocks; call this once after the physics simulation of the frame.
+        """
+        self.moving = np.flatnonzero(self.awake)
+        self.pos[self.moving], self.quat[self.moving] = self.read(self.moving)
+        return self.moving
+
+    def get_rows(self, slots, alpha=1.0):
+        """Return the first 3 rows of the model matrices of the blocks for column vectors,
+           interpolated between the last two physics steps.
+           Args:
+                slots (numpy.ndarray): the slots of the blocks;
+                alpha (float): how far the rendering is from the previous step to the last one;
+        """
+        pos = self.pos[slots]
+        quat = self.quat[slots]
+
+        if alpha < 1:
+            q0 = self.prev_quat[slots]
+            q0 *= np.where((q0 * quat).sum(axis=1) < 0, -1, 1)[:, None]
+            quat = q0 + (quat - q0) * alpha
+            quat /= np.linalg.norm(quat, axis=1)[:, None]
+            pos = self.prev_pos[slots] + (pos - self.prev_pos[slots]) * alpha
+
+        w, x, y, z = quat.T
+        rot = np.stack([
+            1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y),
+            2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x),
+            2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y),
+        ], axis=1).reshape(-1, 3, 3)
+
+        rows = np.empty((len(slots), 3, 4), dtype=np.float32)
+        rows[:, :, :3] = rot * self.scale[slots][:, None, :]
+        rows[:, :, 3] = pos
+        return rows
+
+    def get_motion(self):
+        """Return the longest distance a moving block went in the last physics step.
+        """
+        if not len(slots := self.moving):
+            return 0
+
+        return float(np.linalg.norm(self.pos[slots] - self.prev_pos[slots], axis=1).max())
+
+    def get_drift(self, pos):
+        """Return the longest distance a moving block is from its position in pos,
+           a copy of self.pos taken since the blocks were last added or removed.
+        """
+        if not len(slots := self.moving):
+            return 0
+
+        return float(np.linalg.norm(self.pos[slots] - pos[slots], axis=1).max())
+
+    def get_highest(self):
+        """Return the height of the highest awake block, or None.
+        """
+        if not (awake := self.awake[:self.size]).any():
+            return None
+        return float(self.pos[:self.size, 2][awake].max())
+
+    def find_below(self, z):
+        """Return the awake blocks whose bounding spheres have reached the height z.
+        """
+        n = self.size
+        slots = np.flatnonzero(self.awake[:n] & (self.pos[:n, 2] - self.radius[:n] <= z))
+        return [self.blocks[i] for i in slots]
+
+    def find_colors(self, colors):
+        """Return the live blocks of the colors.
+           Args:
+                colors (list): color ids;
+        """
+        slots = np.flatnonzero(self.alive[:self.size] & np.isin(self.color[:self.size], colors))
+        return [self.blocks[i] for i in slots]
+
+    def get_positions(self, blocks):
+        """Return the positions of the blocks as an array of shape (n, 3).
+        """
+        return self.pos[self.get_slots(blocks)]
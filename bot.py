@@ -0,0 +1,169 @@
+"""Let a bot play the game, throwing every ball at the block whose hit would clear the most blocks.
+
+    python bot.py
+"""
+import math
+from collections import deque
+
+import numpy as np
+from panda3d.core import BitMask32
+
+from tower import Colors
+from towercrash import TowerCrash, Game
+
+
+class ClusterCache:
+    """Keep the clusters of the same colored blocks touching each other, which a normal ball clears.
+       A cluster is found again only if one of its blocks has changed its contacts or its color,
+       so a turn costs one pass over the contact manifolds and the search of the changed clusters.
+       Args:
+            tower (Tower)
+    """
+
+    def __init__(self, tower):
+        self.tower = tower
+        # block node -> the nodes touching it, its color, and the list of the nodes of its cluster.
+        self.neighbors = {}
+        self.colors = {}
+        self.clusters = {}
+
+    def update(self):
+        """Find the clusters changed since the last call.
+        """
+        adjacency = self.tower.get_adjacency()
+        block_index = self.tower.block_index
+        neighbors = {nd: frozenset(adjacency.get(nd, ())) for nd in block_index}
+        colors = {nd: info[2] for nd, info in block_index.items()}
+        changed = set()
+
+        for nd in self.neighbors.keys() - neighbors.keys():
+            changed.add(nd)
+
+        for nd, nds in neighbors.items():
+            if colors[nd] != self.colors.get(nd):
+                # a new color can join the clusters of the neighbors, which have not changed themselves.
+                changed.add(nd)
+                changed.update(nds)
+                changed.update(self.neighbors.get(nd, ()))
+            elif nds != self.neighbors.get(nd):
+                changed.add(nd)
+
+        stale = set(changed)
+        for nd in changed:
+            stale.update(self.clusters.get(nd, ()))
+        for nd in stale:
+            self.clusters.pop(nd, None)
+
+        self.neighbors = neighbors
+        self.colors = colors
+
+        for nd in stale:
+            if nd in neighbors and nd not in self.clusters:
+                self.find_cluster(nd)
+
+    def find_cluster(self, start):
+        color = self.colors[start]
+        cluster = [start]
+        self.clusters[start] = cluster
+        queue = deque([start])
+
+        while queue:
+            for nd in self.neighbors[queue.popleft()]:
+                if nd not in self.clusters and self.colors[nd] == color:
+                    cluster.append(nd)
+                    self.clusters[nd] = cluster
+                    queue.append(nd)
+
+    def get_size(self, nd):
+        """Return the number of the blocks in the cluster of the block node.
+        """
+        return len(self.clusters[nd])
+
+
+class AutoPlayer:
+    """Choose the block to throw the ball at from the number of blocks the hit would clear,
+       and throw it through TowerCrash.throw_ball, as a click does.
+       Args:
+            game (TowerCrash)
+    """
+
+    def __init__(self, game):
+        self.game = game
+        self.cache = None
+
+    def get_scores(self):
+        """Return the moving blocks and the number of blocks the ball in hand would clear by hitting each of them.
+        """
+        tower = self.game.tower
+        if self.cache is None or self.cache.tower is not tower:
+            self.cache = ClusterCache(tower)
+        self.cache.update()
+
+        states = tower.states
+        n = states.size
+        slots = np.flatnonzero(states.awake[:n] & (states.color[:n] != Colors.GRAY))
+        colors = states.color[slots]
+        counts = np.bincount(states.color[:n][states.alive[:n]], minlength=len(Colors))
+
+        kind = self.game.ball.kind
+        match kind:
+            case 6:
+                scores = counts[colors]
+            case 7:
+                scores = counts[:Colors.GRAY].sum() - counts[colors]
+            case _:
+                scores = np.array(
+                    [self.cache.get_size(states.nodes[i]) if c == kind else 0 for i, c in zip(slots, colors)],
+                    dtype=np.int64
+                )
+
+        return [states.blocks[i] for i in slots], scores
+
+    def throw(self):
+        """Throw the ball at the best block seen from the side of the tower, and return True if thrown.
+        """
+        game = self.game
+        blocks, scores = self.get_scores()
+        if not blocks:
+            return False
+
+        heading = game.navigator.get_h()
+
+        positions = game.tower.get_positions(blocks)
+        # the higher of the blocks clearing as many is taken, to bring the tower down.
+        order = np.lexsort((-np.array([p.z for p in positions]), -scores))
+
+        for i in order.tolist():
+            block, pos = blocks[i], positions[i]
+            # face the side of the tower where the block is.
+            game.navigator.set_h(math.degrees(math.atan2(pos.y, pos.x)) + 90)
+            from_pos = game.cam.get_pos(game.render)
+            to_pos = from_pos + (pos - from_pos) * 2
+
+            result = game.world.ray_test_closest(from_pos, to_pos, BitMask32.bit(1))
+            if result.has_hit() and result.get_node() == block.node():
+                if game.throw_ball(from_pos, to_pos):
+                    return True
+
+        # no rotation is recorded unless a ball is thrown, so the camera is put back.
+        game.navigator.set_h(heading)
+        return False
+
+
+def auto_play(game, player, task):
+    """Request a throw whenever the game waits for a ball and the tower has stopped moving.
+    """
+    if game.state == Game.PLAY and game.tower.get_motion() < 1e-4:
+        # thrown in the next update as a click is, so that a recorded session replays the same.
+        game.request(player.throw)
+    return task.cont
+
+
+def main():
+    game = TowerCrash()
+    game.taskMgr.add(auto_play, 'auto_play', extraArgs=[game, AutoPlayer(game)], appendTask=True)
+    game.run()
+
+
+if __name__ == '__main__':
+    main()
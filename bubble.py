@@ -1,51 +1,129 @@
 import random
 
+import numpy as np
+from direct.interval.IntervalGlobal import Func
+from direct.showbase.ShowBaseGlobal import globalClock
 from panda3d.core import PandaNode, NodePath
-from panda3d.core import Vec3
-from direct.interval.IntervalGlobal import Sequence, Parallel, Func
 
 from create_geomnode import SphereGeom
+from instrument import stage_timer
+from prototypes import prototypes
 
 
 class Bubbles:
+    """A pool of bubbles moved together by one task.
+       Args:
+            size (int): the number of bubbles in the pool;
+    """
 
-    def __init__(self):
+    def __init__(self, size=4096):
         self.numbers = [n for n in range(-5, 5) if n != 0]
-        self.bubble = SphereGeom()
+        self.bubble = prototypes.get_model(SphereGeom)
+        self.per_block = 8
+        self.segments = 22
+        self.duration = 0.5
+        # not the random module, so that the bubbles do not change the game played with a seed.
+        self.random = random.Random()
 
-    def create_bubble(self, bubbles, color, pos):
-        bubble = self.bubble.copy_to(bubbles)
-        bubble.reparent_to(bubbles)
-        bubble.set_pos(pos)
-        bubble.set_color(color)
-        bubble.set_scale(0.2)
+        self.root = NodePath(PandaNode('bubbles'))
+        self.root.reparent_to(base.render)
+        self.pool = [self.bubble.copy_to(self.root) for _ in range(size)]
+        for bubble in self.pool:
+            bubble.stash()
 
-        return bubble
+        self.start_pos = np.zeros((size, 3), dtype=np.float32)
+        self.delta1 = np.zeros((size, 3), dtype=np.float32)
+        self.delta2 = np.zeros((size, 3), dtype=np.float32)
+        self.age = np.zeros(size, dtype=np.float32)
+        self.live = np.zeros(size, dtype=bool)
+        self.free = list(range(size - 1, -1, -1))
 
-    def calc_delta(self):
-        x = random.choice(self.numbers)
-        y = random.choice(self.numbers)
-        z = abs(random.choice(self.numbers))
-        d1 = Vec3(x, y, z)
-        d2 = Vec3(d1.x * 2, d1.y * 2, -d1.z)
+        base.taskMgr.add(self.update, 'update_bubbles')
+
+    @property
+    def count(self):
+        """The number of the bubbles in motion.
+        """
+        return int(np.count_nonzero(self.live))
+
+    def set_quality(self, per_block, segments):
+        """Change the number of bubbles emitted a block and the subdivisions of their spheres.
+        """
+        self.per_block = per_block
+
+        if segments != self.segments:
+            self.segments = segments
+            geom = prototypes.get_geom(SphereGeom, segments=segments).get_geom(0)
+            for bubble in self.pool:
+                bubble.get_child(0).node().set_geom(0, geom)
+
+    def calc_delta(self, n):
+        d1 = np.array(self.random.choices(self.numbers, k=n * 3), dtype=np.float32).reshape(n, 3)
+        d1[:, 2] = np.abs(d1[:, 2])
+        d2 = d1 * (2, 2, -1)
 
         return d1, d2
 
-    def create_seq(self, bubbles, color, pos):
-        for i in range(8):
-            bub = self.create_bubble(bubbles, color, pos)
-            delta1, delta2 = self.calc_delta()
+    def acquire(self):
+        """Return the index of a free bubble; if there is none, reuse the oldest one.
+        """
+        if self.free:
+            return self.free.pop()
+
+        i = int(np.argmax(np.where(self.live, self.age, -1)))
+        # made the youngest at once, so that the next call of the same emit takes another one.
+        self.age[i] = 0
+        return i
+
+    def release(self, indices):
+        for i in indices:
+            self.pool[i].stash()
+        self.live[indices] = False
+        self.free.extend(indices)
 
-            yield Sequence(
-                bub.posHprScaleInterval(0.5, bub.get_pos() + delta1, bub.get_hpr(), 0.1),
-                bub.posHprScaleInterval(0.5, bub.get_pos() + delta2, bub.get_hpr(), 0.01),
-            )
+    @stage_timer.timed('bubbles_emit')
+    def emit(self, color, pos):
+        idx = [self.acquire() for _ in range(self.per_block)]
+        self.start_pos[idx] = pos
+        self.delta1[idx], self.delta2[idx] = self.calc_delta(self.per_block)
+        self.age[idx] = 0
+        self.live[idx] = True
+        x, y, z = pos
 
+        for i in idx:
+            bubble = self.pool[i]
+            bubble.set_color(color)
+            bubble.set_pos_hpr_scale(x, y, z, 0, 0, 0, 0.2, 0.2, 0.2)
+            bubble.unstash()
+
+    @stage_timer.timed('bubbles_get_sequence')
     def get_sequence(self, color, pos):
-        bubbles = NodePath(PandaNode('bubbles'))
-        bubbles.reparent_to(base.render)
+        """Return an interval making bubbles of the color rise and fall at the pos.
+        """
+        return Func(self.emit, color, pos)
+
+    def update(self, task):
+        if not self.live.any():
+            return task.cont
+
+        idx = np.flatnonzero(self.live)
+        self.age[idx] += globalClock.get_dt()
+        age = self.age[idx]
+
+        if (done := age >= self.duration * 2).any():
+            self.release(idx[done].tolist())
+            idx = idx[~done]
+            age = age[~done]
+
+        # the bubbles go up by delta1 while shrinking, and then go to delta2.
+        rising = age < self.duration
+        rate = np.where(rising, age, age - self.duration) / self.duration
+        start = self.start_pos[idx] + np.where(rising[:, None], 0, self.delta1[idx])
+        end = self.start_pos[idx] + np.where(rising[:, None], self.delta1[idx], self.delta2[idx])
+        pos = start + (end - start) * rate[:, None]
+        scale = np.where(rising, 0.2 - 0.1 * rate, 0.1 - 0.09 * rate)
+
+        for i, (x, y, z), s in zip(idx.tolist(), pos.tolist(), scale.tolist()):
+            self.pool[i].set_pos_hpr_scale(x, y, z, 0, 0, 0, s, s, s)
 
-        return Sequence(
-            Parallel(*(seq for seq in self.create_seq(bubbles, color, pos))),
-            Func(lambda: bubbles.remove_node())
-        )
\ No newline at end of file
+        return task.cont
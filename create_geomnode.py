@@ -1,7 +1,5 @@
-import array
-import math
+import numpy as np
 
-from panda3d.core import Vec3, Point3
 from panda3d.core import NodePath
 from panda3d.core import Geom, GeomNode, GeomTriangles
 from panda3d.core import GeomVertexFormat, GeomVertexData, GeomVertexArrayFormat
@@ -25,21 +23,23 @@ class GeomRoot(NodePath):
 
     def create_geomnode(self):
         fmt = self.create_format()
-        vdata_values = array.array('f', [])
-        prim_indices = array.array('H', [])
-
-        vertex_count = self.get_vertices(vdata_values, prim_indices)
+        vdata_values, prim_indices = self.get_vertices()
 
         vdata = GeomVertexData('geom_vertex', fmt, Geom.UHStatic)
-        vdata.unclean_set_num_rows(vertex_count)
-        vdata_mem = memoryview(vdata.modify_array(0)).cast('B').cast('f')
-        vdata_mem[:] = vdata_values
+        vdata.unclean_set_num_rows(len(vdata_values))
+        vdata_mem = np.frombuffer(memoryview(vdata.modify_array(0)).cast('B'), dtype=np.float32)
+        vdata_mem[:] = vdata_values.ravel()
 
         prim = GeomTriangles(Geom.UHStatic)
+        if len(vdata_values) > 0xffff:
+            prim.set_index_type(Geom.NT_uint32)
+            prim_indices = prim_indices.astype(np.uint32)
+        else:
+            prim_indices = prim_indices.astype(np.uint16)
         prim_array = prim.modify_vertices()
-        prim_array.unclean_set_num_rows(len(prim_indices))
-        prim_mem = memoryview(prim_array).cast('B').cast('H')
-        prim_mem[:] = prim_indices
+        prim_array.unclean_set_num_rows(prim_indices.size)
+        prim_mem = np.frombuffer(memoryview(prim_array).cast('B'), dtype=prim_indices.dtype)
+        prim_mem[:] = prim_indices.ravel()
 
         node = GeomNode('geomnode')
         geom = Geom(vdata)
@@ -47,6 +47,31 @@ class GeomRoot(NodePath):
         node.add_geom(geom)
         return node
 
+    def pack(self, vertices, normals, uvs):
+        """Return the rows of the interleaved vertex, color, normal and texcoord columns.
+        """
+        values = np.empty((len(vertices), 12), dtype=np.float32)
+        values[:, 0:3] = vertices
+        values[:, 3:7] = self.color
+        values[:, 7:10] = normals
+        values[:, 10:12] = uvs
+        return values
+
+    @staticmethod
+    def grid_indices(rows, cols, offset=0, quads=None):
+        """Return the triangles joining rows of vertices, cols vertices each.
+           Args:
+                rows (int): the number of rows of vertices;
+                cols (int): the number of vertices in a row;
+                offset (int): the index of the first vertex;
+                quads (int): the number of quads in a row; cols - 1 by default;
+        """
+        quads = cols - 1 if quads is None else quads
+        i, j = np.mgrid[1:rows, 0:quads]
+        px = (offset + i * cols + j).ravel()
+        return np.stack(
+            [px, px - cols, px - cols + 1, px, px - cols + 1, px + 1], axis=1).reshape(-1, 3)
+
 
 class CylinderGeom(GeomRoot):
     """Create a geom node of cylinder.
@@ -65,97 +90,57 @@ class CylinderGeom(GeomRoot):
         self.color = (1, 1, 1, 1)
         super().__init__()
 
-    def cap_vertices(self, delta_angle, bottom=True):
+    def create_cap(self, index_offset, bottom=True):
         z = 0 if bottom else self.height
-
-        # vertex and uv of the center
-        yield ((0, 0, z), (0.5, 0.5))
-
-        # vertex and uv of triangles
-        for i in range(self.segs_c):
-            angle = delta_angle * i
-            c = math.cos(angle)
-            s = math.sin(angle)
-            x = self.radius * c
-            y = self.radius * s
-            u = 0.5 + c * 0.5
-            v = 0.5 - s * 0.5
-            yield ((x, y, z), (u, v))
-
-    def create_bottom_cap(self, delta_angle, vdata_values, prim_indices):
-        normal = (0, 0, -1)
-
-        # bottom cap center and triangle vertices
-        for vertex, uv in self.cap_vertices(delta_angle, bottom=True):
-            vdata_values.extend(vertex)
-            vdata_values.extend(self.color)
-            vdata_values.extend(normal)
-            vdata_values.extend(uv)
-
-        # the vertex order of the bottom cap vertices
-        for i in range(self.segs_c - 1):
-            prim_indices.extend((0, i + 2, i + 1))
-        prim_indices.extend((0, 1, self.segs_c))
-
-        return self.segs_c + 1
-
-    def create_mantle(self, index_offset, delta_angle, vdata_values, prim_indices):
-        vertex_count = 0
-
-        # mantle triangle vertices
-        for i in range(self.segs_a + 1):
-            z = self.height * i / self.segs_a
-            v = i / self.segs_a
-
-            for j in range(self.segs_c + 1):
-                angle = delta_angle * j
-                x = self.radius * math.cos(angle)
-                y = self.radius * math.sin(angle)
-                normal = Vec3(x, y, 0.0).normalized()
-                u = j / self.segs_c
-                vdata_values.extend((x, y, z))
-                vdata_values.extend(self.color)
-                vdata_values.extend(normal)
-                vdata_values.extend((u, v))
-
-            vertex_count += self.segs_c + 1
-
-            # the vertex order of the mantle vertices
-            if i > 0:
-                for j in range(self.segs_c):
-                    px = index_offset + i * (self.segs_c + 1) + j
-                    prim_indices.extend((px, px - self.segs_c - 1, px - self.segs_c))
-                    prim_indices.extend((px, px - self.segs_c, px + 1))
-
-        return vertex_count
-
-    def create_top_cap(self, index_offset, delta_angle, vdata_values, prim_indices):
-        normal = (0, 0, 1)
-
-        # top cap center and triangle vertices
-        for vertex, uv in self.cap_vertices(delta_angle, bottom=False):
-            vdata_values.extend(vertex)
-            vdata_values.extend(self.color)
-            vdata_values.extend(normal)
-            vdata_values.extend(uv)
-
-        # the vertex order of top cap vertices
-        for i in range(index_offset + 1, index_offset + self.segs_c):
-            prim_indices.extend((index_offset + self.segs_c, i - 1, i))
-        prim_indices.extend((index_offset + self.segs_c, index_offset, index_offset + self.segs_c - 1))
-
-        return self.segs_c + 1
-
-    def get_vertices(self, vdata_values, prim_indices):
-        delta_angle = 2 * math.pi / self.segs_c
-        vertex_count = 0
-
+        angle = 2 * np.pi / self.segs_c * np.arange(self.segs_c)
+        c = np.cos(angle)
+        s = np.sin(angle)
+
+        # the center, and then the vertices on the circle
+        vertices = np.zeros((self.segs_c + 1, 3))
+        vertices[1:, 0] = self.radius * c
+        vertices[1:, 1] = self.radius * s
+        vertices[:, 2] = z
+        uvs = np.full((self.segs_c + 1, 2), 0.5)
+        uvs[1:, 0] += c * 0.5
+        uvs[1:, 1] -= s * 0.5
+        normals = (0, 0, -1) if bottom else (0, 0, 1)
+
+        # the vertex order of the cap vertices
+        i = np.arange(self.segs_c - 1)
+        if bottom:
+            indices = np.stack([np.zeros_like(i), i + 2, i + 1], axis=1)
+            last = (0, 1, self.segs_c)
+        else:
+            indices = np.stack([np.full_like(i, self.segs_c), i, i + 1], axis=1)
+            last = (self.segs_c, 0, self.segs_c - 1)
+
+        indices = np.concatenate([indices, [last]]) + index_offset
+        return self.pack(vertices, normals, uvs), indices
+
+    def create_mantle(self, index_offset):
+        angle = 2 * np.pi / self.segs_c * np.arange(self.segs_c + 1)
+        z, angle = np.meshgrid(self.height * np.arange(self.segs_a + 1) / self.segs_a, angle, indexing='ij')
+        x = self.radius * np.cos(angle)
+        y = self.radius * np.sin(angle)
+
+        vertices = np.stack([x, y, z], axis=-1).reshape(-1, 3)
+        normals = np.stack([np.cos(angle), np.sin(angle), np.zeros_like(z)], axis=-1).reshape(-1, 3)
+        u, v = np.meshgrid(np.arange(self.segs_c + 1) / self.segs_c,
+                           np.arange(self.segs_a + 1) / self.segs_a)
+        uvs = np.stack([u, v], axis=-1).reshape(-1, 2)
+
+        indices = self.grid_indices(self.segs_a + 1, self.segs_c + 1, index_offset)
+        return self.pack(vertices, normals, uvs), indices
+
+    def get_vertices(self):
         # create vertices of the bottom cap, mantle and top cap.
-        vertex_count += self.create_bottom_cap(delta_angle, vdata_values, prim_indices)
-        vertex_count += self.create_mantle(vertex_count, delta_angle, vdata_values, prim_indices)
-        vertex_count += self.create_top_cap(vertex_count, delta_angle, vdata_values, prim_indices)
+        bottom = self.create_cap(0, bottom=True)
+        mantle = self.create_mantle(len(bottom[0]))
+        top = self.create_cap(len(bottom[0]) + len(mantle[0]), bottom=False)
+        parts = (bottom, mantle, top)
 
-        return vertex_count
+        return np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts])
 
 
 class SphereGeom(GeomRoot):
@@ -171,85 +156,52 @@ class SphereGeom(GeomRoot):
         self.color = (1, 1, 1, 1)
         super().__init__()
 
-    def create_bottom_pole(self, vdata_values, prim_indices):
-        # the bottom pole vertices
-        normal = (0.0, 0.0, -1.0)
-        vertex = (0.0, 0.0, -self.radius)
-
-        for i in range(self.segments):
-            u = i / self.segments
-            vdata_values.extend(vertex)
-            vdata_values.extend(self.color)
-            vdata_values.extend(normal)
-            vdata_values.extend((u, 0.0))
-
-            # the vertex order of the pole vertices
-            prim_indices.extend((i, i + self.segments + 1, i + self.segments))
-
-        return self.segments
-
-    def create_quads(self, index_offset, vdata_values, prim_indices):
-        delta_angle = 2 * math.pi / self.segments
-        vertex_count = 0
-
-        # the quad vertices
-        for i in range((self.segments - 2) // 2):
-            angle_v = delta_angle * (i + 1)
-            radius_h = self.radius * math.sin(angle_v)
-            z = self.radius * -math.cos(angle_v)
-            v = 2.0 * (i + 1) / self.segments
-
-            for j in range(self.segments + 1):
-                angle = delta_angle * j
-                c = math.cos(angle)
-                s = math.sin(angle)
-                x = radius_h * c
-                y = radius_h * s
-                normal = Vec3(x, y, z).normalized()
-                u = j / self.segments
-
-                vdata_values.extend((x, y, z))
-                vdata_values.extend(self.color)
-                vdata_values.extend(normal)
-                vdata_values.extend((u, v))
-
-                # the vertex order of the quad vertices
-                if i > 0 and j <= self.segments:
-                    px = i * (self.segments + 1) + j + index_offset
-                    prim_indices.extend((px, px - self.segments - 1, px - self.segments))
-                    prim_indices.extend((px, px - self.segments, px + 1))
-
-            vertex_count += self.segments + 1
-
-        return vertex_count
-
-    def create_top_pole(self, index_offset, vdata_values, prim_indices):
-        vertex = (0.0, 0.0, self.radius)
-        normal = (0.0, 0.0, 1.0)
-
-        # the top pole vertices
-        for i in range(self.segments):
-            u = i / self.segments
-            vdata_values.extend(vertex)
-            vdata_values.extend(self.color)
-            vdata_values.extend(normal)
-            vdata_values.extend((u, 1.0))
-
-            # the vertex order of the top pole vertices
-            x = i + index_offset
-            prim_indices.extend((x, x + 1, x + self.segments + 1))
-
-        return self.segments
-
-    def get_vertices(self, vdata_values, prim_indices):
-        vertex_count = 0
-
+    def create_pole(self, index_offset, bottom=True):
+        i = np.arange(self.segments)
+        z, v = (-self.radius, 0.0) if bottom else (self.radius, 1.0)
+
+        vertices = np.zeros((self.segments, 3))
+        vertices[:, 2] = z
+        normals = (0.0, 0.0, -1.0) if bottom else (0.0, 0.0, 1.0)
+        uvs = np.stack([i / self.segments, np.full(self.segments, v)], axis=1)
+
+        # the vertex order of the pole vertices
+        if bottom:
+            indices = np.stack([i, i + self.segments + 1, i + self.segments], axis=1)
+        else:
+            indices = np.stack([i, i + 1, i + self.segments + 1], axis=1) + index_offset
+
+        return self.pack(vertices, normals, uvs), indices
+
+    def create_quads(self, index_offset):
+        delta_angle = 2 * np.pi / self.segments
+        rows = (self.segments - 2) // 2
+
+        angle_v = delta_angle * (np.arange(rows) + 1)
+        angle = delta_angle * np.arange(self.segments + 1)
+        radius_h = (self.radius * np.sin(angle_v))[:, None]
+        x = radius_h * np.cos(angle)
+        y = radius_h * np.sin(angle)
+        z = np.broadcast_to((self.radius * -np.cos(angle_v))[:, None], x.shape)
+
+        vertices = np.stack([x, y, z], axis=-1).reshape(-1, 3)
+        normals = vertices / np.linalg.norm(vertices, axis=1, keepdims=True)
+        u, v = np.meshgrid(np.arange(self.segments + 1) / self.segments,
+                           2.0 * (np.arange(rows) + 1) / self.segments)
+        uvs = np.stack([u, v], axis=-1).reshape(-1, 2)
+
+        # every row has segments + 1 quads; the last one reaches the start of the next row.
+        indices = self.grid_indices(rows, self.segments + 1, index_offset, self.segments + 1)
+        return self.pack(vertices, normals, uvs), indices
+
+    def get_vertices(self):
         # create vertices of the bottom pole, quads, and top pole
-        vertex_count += self.create_bottom_pole(vdata_values, prim_indices)
-        vertex_count += self.create_quads(vertex_count, vdata_values, prim_indices)
-        vertex_count += self.create_top_pole(vertex_count - self.segments - 1, vdata_values, prim_indices)
+        bottom = self.create_pole(0, bottom=True)
+        quads = self.create_quads(len(bottom[0]))
+        top = self.create_pole(len(bottom[0]) + len(quads[0]) - self.segments - 1, bottom=False)
+        parts = (bottom, quads, top)
 
-        return vertex_count
+        return np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts])
 
 
 class CubeGeom(GeomRoot):
@@ -273,11 +225,12 @@ class CubeGeom(GeomRoot):
         self.color = (1, 1, 1, 1)
         super().__init__()
 
-    def get_vertices(self, vdata_values, prim_indices):
+    def get_vertices(self):
         vertex_count = 0
-        vertex = Point3()
         segs = (self.segs_w, self.segs_d, self.segs_h)
         dims = (self.w, self.d, self.h)
+        values = []
+        indices = []
 
         # (fixed, outer loop, inner loop, normal, uv)
         side_idxes = [
@@ -292,33 +245,21 @@ class CubeGeom(GeomRoot):
         for a, (i0, i1, i2, n, reverse) in enumerate(side_idxes):
             segs1 = segs[i1]
             segs2 = segs[i2]
-            dim1_start = dims[i1] * -0.5
-            dim2_start = dims[i2] * -0.5
+            v, u = np.meshgrid(np.arange(segs1 + 1) / segs1, np.arange(segs2 + 1) / segs2, indexing='ij')
 
-            normal = Vec3()
+            vertices = np.empty((segs1 + 1, segs2 + 1, 3))
+            vertices[..., i0] = dims[i0] * 0.5 * n
+            vertices[..., i1] = dims[i1] * -0.5 + v * dims[i1]
+            vertices[..., i2] = dims[i2] * -0.5 + u * dims[i2]
+            normal = [0, 0, 0]
             normal[i0] = n
-            vertex[i0] = dims[i0] * 0.5 * n
-
-            for j in range(segs1 + 1):
-                vertex[i1] = dim1_start + j / segs1 * dims[i1]
-                v = j / segs1
-
-                for k in range(segs2 + 1):
-                    vertex[i2] = dim2_start + k / segs2 * dims[i2]
-                    u = k / segs2
-                    vdata_values.extend(vertex)
-                    vdata_values.extend(self.color)
-                    vdata_values.extend(normal)
-                    vdata_values.extend((u, v))
-                if j > 0:
-                    for k in range(segs2):
-                        idx = vertex_count + j * (segs2 + 1) + k
-                        prim_indices.extend((idx, idx - segs2 - 1, idx - segs2))
-                        prim_indices.extend((idx, idx - segs2, idx + 1))
+            uvs = np.stack([u, v], axis=-1)
 
+            values.append(self.pack(vertices.reshape(-1, 3), normal, uvs.reshape(-1, 2)))
+            indices.append(self.grid_indices(segs1 + 1, segs2 + 1, vertex_count))
             vertex_count += (segs1 + 1) * (segs2 + 1)
 
-        return vertex_count
+        return np.concatenate(values), np.concatenate(indices)
 
 
 class TriangularPrismGeom(GeomRoot):
@@ -336,86 +277,58 @@ class TriangularPrismGeom(GeomRoot):
         self.color = (1, 1, 1, 1)
         super().__init__()
 
-    def create_caps(self, points, index_offset, vdata_values, prim_indices):
-        vertex_count = 0
-        normal = (0, 0, 1) if all(pt.z > 0 for pt in points) else (0, 0, -1)
-        v = 0
-
-        for i, pt in enumerate(points):
-            u = i / (len(points) - 1)
-            vdata_values.extend(pt)
-            vdata_values.extend(self.color)
-            vdata_values.extend(normal)
-            vdata_values.extend((u, v))
-            vertex_count += 1
+    def create_caps(self, points, index_offset):
+        normal = (0, 0, 1) if (points[:, 2] > 0).all() else (0, 0, -1)
+        uvs = np.stack([np.arange(len(points)) / (len(points) - 1), np.zeros(len(points))], axis=1)
+        indices = np.array([[0, 2, 1]]) + index_offset
 
-        prim_indices.extend((index_offset, index_offset + 2, index_offset + 1))
+        return self.pack(points, normal, uvs), indices
 
-        return vertex_count
-
-    def create_sides(self, sides, index_offset, vdata_values, prim_indices):
-        vertex_count = 0
-        vertex = Point3()
+    def create_sides(self, sides, index_offset):
         segs_u = len(sides)
+        v = np.arange(self.segs_h + 1) / self.segs_h
+        z = -self.h / 2 + v * self.h
+        values = []
+        indices = []
 
         for a, pts in enumerate(sides):
             pts_cnt = len(pts)
 
-            if pts[0].y < 0 and pts[1].y < 0:
+            if pts[0][1] < 0 and pts[1][1] < 0:
                 normal = (0, -1, 0)
-            elif pts[0].x > 0:
+            elif pts[0][0] > 0:
                 normal = (1, 0, 0)
-            elif pts[1].x < 0:
+            elif pts[1][0] < 0:
                 normal = (-1, 0, 0)
 
-            for i in range(self.segs_h + 1):
-                v = i / self.segs_h
-                vertex.z = -self.h / 2 + i / self.segs_h * self.h
-
-                for j in range(pts_cnt):
-                    pt = pts[j]
-                    vertex.x, vertex.y = pt.x, pt.y
-                    u = (a + j) / segs_u
-
-                    vdata_values.extend(vertex)
-                    vdata_values.extend(self.color)
-                    vdata_values.extend(normal)
-                    vdata_values.extend((u, v))
-                    vertex_count += 1
-
-                if i > 0:
-                    idx = index_offset + i * (1 + 1)
-                    prim_indices.extend((idx, idx - 2, idx - 1))
-                    prim_indices.extend((idx, idx - 1, idx + 1))
+            vertices = np.empty((self.segs_h + 1, pts_cnt, 3))
+            vertices[..., :2] = pts[:, :2]
+            vertices[..., 2] = z[:, None]
+            u, vv = np.meshgrid((a + np.arange(pts_cnt)) / segs_u, v)
+            uvs = np.stack([u, vv], axis=-1)
 
+            values.append(self.pack(vertices.reshape(-1, 3), normal, uvs.reshape(-1, 2)))
+            indices.append(self.grid_indices(self.segs_h + 1, pts_cnt, index_offset))
             index_offset += pts_cnt * (self.segs_h + 1)
 
-        return vertex_count
+        return np.concatenate(values), np.concatenate(indices)
 
-    def get_vertices(self, vdata_values, prim_indices):
+    def get_vertices(self):
         half_s = self.side / 2
         half_h = self.h / 2
 
-        top = [
-            Point3(0, half_s / math.sqrt(3) * 2, half_h),
-            Point3(-half_s, -half_s / math.sqrt(3), half_h),
-            Point3(half_s, -half_s / math.sqrt(3), half_h)
-        ]
-        bottom = [
-            Point3(0, half_s / math.sqrt(3) * 2, -half_h),
-            Point3(-half_s, -half_s / math.sqrt(3), -half_h),
-            Point3(half_s, -half_s / math.sqrt(3), -half_h)
-        ]
-
-        sides = [
-            (bottom[1], bottom[2]),
-            (bottom[2], bottom[0]),
-            (bottom[0], bottom[1]),
-        ]
-
-        vertex_count = 0
-        vertex_count += self.create_caps(top, vertex_count, vdata_values, prim_indices)
-        vertex_count += self.create_sides(sides, vertex_count, vdata_values, prim_indices)
-        vertex_count += self.create_caps(bottom, vertex_count, vdata_values, prim_indices)
-
-        return vertex_count
\ No newline at end of file
+        triangle = np.array([
+            [0, half_s / np.sqrt(3) * 2],
+            [-half_s, -half_s / np.sqrt(3)],
+            [half_s, -half_s / np.sqrt(3)]
+        ])
+        top = np.column_stack([triangle, np.full(3, half_h)])
+        bottom = np.column_stack([triangle, np.full(3, -half_h)])
+        sides = [bottom[[1, 2]], bottom[[2, 0]], bottom[[0, 1]]]
+
+        caps_top = self.create_caps(top, 0)
+        mantle = self.create_sides(sides, len(caps_top[0]))
+        caps_bottom = self.create_caps(bottom, len(caps_top[0]) + len(mantle[0]))
+        parts = (caps_top, mantle, caps_bottom)
+
+        return np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts])
@@ -0,0 +1,99 @@
+from collections import deque
+
+import numpy as np
+from direct.directnotify.DirectNotifyGlobal import directNotify
+from panda3d.core import ConfigVariableBool, ConfigVariableDouble, ConfigVariableInt
+
+
+governor_enabled = ConfigVariableBool(
+    'quality-governor', True,
+    'If True, the quality is lowered and raised to hold quality-target-fps.')
+
+target_fps = ConfigVariableDouble(
+    'quality-target-fps', 60,
+    'The frame rate the quality governor tries to hold.')
+
+window_size = ConfigVariableInt(
+    'quality-window', 120,
+    'The number of frames whose times are judged at a time.')
+
+
+# shadow map size, reflection buffer size, frames per reflection update, bubbles per block, bubble segments
+TIERS = [
+    dict(shadow=8192, reflection=512, reflection_interval=1, bubbles=8, bubble_segments=22),
+    dict(shadow=4096, reflection=512, reflection_interval=2, bubbles=6, bubble_segments=16),
+    dict(shadow=2048, reflection=256, reflection_interval=2, bubbles=4, bubble_segments=12),
+    dict(shadow=1024, reflection=256, reflection_interval=4, bubbles=2, bubble_segments=8),
+]
+
+
+class QualityGovernor:
+    """Watch the frame times over a window, and step the quality tiers down when the frames
+       take longer than the target, and up again after the target has been held for a while.
+       As frames limited by vsync never show spare time, raising the quality is a trial:
+       if the next window misses the target, the tier goes back and the next trial waits longer.
+       Args:
+            game (TowerCrash)
+    """
+
+    notify = directNotify.newCategory('QualityGovernor')
+
+    def __init__(self, game):
+        self.game = game
+        self.budget = 1 / target_fps.get_value()
+        self.times = deque(maxlen=window_size.get_value())
+        self.tier = 0
+        self.held = 0
+        self.wait = 2
+        self.trial = False
+        self.changed = False
+
+    def apply(self, tier):
+        quality = TIERS[tier]
+        self.game.directional_light.set_shadow_size(quality['shadow'])
+        self.game.scene.set_reflection(quality['reflection'], quality['reflection_interval'])
+        self.game.ball.bubbles.set_quality(quality['bubbles'], quality['bubble_segments'])
+
+    def change(self, tier, mean, p95):
+        self.notify.info(
+            f'tier {self.tier} -> {tier}: mean {mean * 1000:.2f} ms, p95 {p95 * 1000:.2f} ms, '
+            f'target {self.budget * 1000:.2f} ms; {TIERS[tier]}')
+        self.tier = tier
+        self.apply(tier)
+        self.held = 0
+        self.changed = True
+
+    def update(self, frame_time):
+        """frame_time (float): the seconds the last frame took;
+        """
+        self.times.append(frame_time)
+        if len(self.times) < self.times.maxlen:
+            return
+
+        times = np.array(self.times)
+        self.times.clear()
+        mean = times.mean()
+        p95 = np.percentile(times, 95)
+        missed = mean > self.budget * 1.1
+
+        if self.changed:
+            self.notify.info(f'tier {self.tier}: mean {mean * 1000:.2f} ms, p95 {p95 * 1000:.2f} ms')
+            self.changed = False
+
+        if missed:
+            if self.trial:
+                # the higher tier could not be held; try again later.
+                self.wait *= 2
+            if self.tier < len(TIERS) - 1:
+                self.change(self.tier + 1, mean, p95)
+            self.trial = False
+            return
+
+        if self.trial:
+            self.wait = 2
+        self.trial = False
+        self.held += 1
+
+        if self.tier > 0 and self.held >= self.wait:
+            self.change(self.tier - 1, mean, p95)
+            self.trial = True
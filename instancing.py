@@ -0,0 +1,99 @@
+import numpy as np
+from panda3d.core import NodePath, PandaNode, OmniBoundingVolume
+from panda3d.core import Shader, Texture, GeomEnums
+
+
+class BlockInstances(NodePath):
+    """Draw all the blocks made from one prototype with a single instanced geom.
+       The transform and color of each block are stored in a buffer texture,
+       4 texels a block: 3 rows of the model matrix and the color.
+       Args:
+            name (str): the name of the prototype;
+            model (NodePath): the visual child of a block;
+            capacity (int): the initial number of the blocks;
+    """
+
+    def __init__(self, name, model, capacity=64):
+        super().__init__(PandaNode(f'instances_{name}'))
+        # Bake the transform of the visual child into its vertices.
+        holder = NodePath('holder')
+        model.copy_to(holder)
+        holder.flatten_light()
+        self.model = holder.get_child(0)
+        self.model.reparent_to(self)
+
+        self.node().set_bounds(OmniBoundingVolume())
+        self.node().set_final(True)
+        self.set_shader(Shader.load(Shader.SL_GLSL, 'shaders/block_v.glsl', 'shaders/block_f.glsl'))
+
+        self.blocks = []
+        self.slots = {}
+        self.data = None
+        self.buffer = Texture(f'buffer_{name}')
+        self.resize(capacity)
+        self.set_instance_count(0)
+
+    def resize(self, capacity):
+        data = np.zeros((capacity, 4, 4), dtype=np.float32)
+        if self.data is not None:
+            data[:len(self.blocks)] = self.data[:len(self.blocks)]
+
+        self.data = data
+        self.buffer.setup_buffer_texture(capacity * 4, Texture.T_float, Texture.F_rgba32, GeomEnums.UH_dynamic)
+        self.set_shader_input('instances', self.buffer)
+        self.dirty = True
+
+    def add(self, block, rgba):
+        if (n := len(self.blocks)) == len(self.data):
+            self.resize(n * 2)
+
+        self.slots[block.node()] = n
+        self.blocks.append(block)
+        self.set_instance_count(n + 1)
+        if n == 0:
+            self.unstash()
+        self.write(block)
+        self.data[n, 3] = rgba
+
+    def remove(self, block):
+        """Move the last block into the slot of the removed block.
+        """
+        i = self.slots.pop(block.node())
+        last = self.blocks.pop()
+
+        if last.node() != block.node():
+            self.blocks[i] = last
+            self.slots[last.node()] = i
+            self.data[i] = self.data[len(self.blocks)]
+
+        self.set_instance_count(len(self.blocks))
+        # A count of 0 turns instancing off and draws slot 0 once, so keep the node stashed while it is empty.
+        if not self.blocks:
+            self.stash()
+        self.dirty = True
+
+    def set_color(self, block, rgba):
+        self.data[self.slots[block.node()], 3] = rgba
+        self.dirty = True
+
+    def write(self, block, mat=None):
+        # Panda3D's matrices are row-major for row vectors, so use their columns.
+        if mat is None:
+            mat = block.get_mat()
+        i = self.slots[block.node()]
+        self.data[i, :3] = np.array(mat, dtype=np.float32).T[:3]
+        self.dirty = True
+
+    def write_rows(self, nodes, rows):
+        """Args:
+                nodes (list): the nodes of the blocks;
+                rows (numpy.ndarray): the first 3 rows of their model matrices for column vectors;
+        """
+        self.data[[self.slots[node] for node in nodes], :3] = rows
+        self.dirty = True
+
+    def upload(self):
+        if self.dirty:
+            mem = np.frombuffer(memoryview(self.buffer.modify_ram_image()), dtype=np.float32)
+            mem[:] = self.data.ravel()
+            self.dirty = False
@@ -0,0 +1,116 @@
+import functools
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from direct.directnotify.DirectNotifyGlobal import directNotify
+from panda3d.core import ConfigVariableString, ConfigVariableInt, ConfigVariableDouble
+from panda3d.core import PStatCollector
+
+
+timer_mode = ConfigVariableString(
+    'stage-timer', 'python',
+    'How the stages of a frame are timed: none, python, pstats or both. '
+    'PStats collectors need want-pstats to be true.')
+
+history_size = ConfigVariableInt(
+    'stage-timer-history', 600,
+    'The number of frames whose stage timings are kept.')
+
+spike_ms = ConfigVariableDouble(
+    'stage-timer-spike', 0,
+    'If positive, a frame whose stages took longer than this, in milliseconds, is logged.')
+
+
+class StageTimer:
+    """Measure how long each stage of a frame takes, in seconds, and keep the timings
+       of the last frames in a ring buffer; the stages can also be sent to PStats.
+    """
+
+    notify = directNotify.newCategory('StageTimer')
+
+    def __init__(self):
+        mode = timer_mode.get_value()
+        self.python = mode in ('python', 'both')
+        self.pstats = mode in ('pstats', 'both')
+        self.collectors = {}
+
+        self.frame = {}
+        self.last = {}
+        self.history = deque(maxlen=history_size.get_value())
+        self.frame_count = 0
+
+    def get_collector(self, name):
+        if (collector := self.collectors.get(name)) is None:
+            collector = self.collectors[name] = PStatCollector(f'App:Stages:{name}')
+        return collector
+
+    @contextmanager
+    def measure(self, name):
+        if self.pstats:
+            collector = self.get_collector(name)
+            collector.start()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.python:
+                self.frame[name] = self.frame.get(name, 0) + time.perf_counter() - start
+            if self.pstats:
+                collector.stop()
+
+    def timed(self, name):
+        """Return a decorator measuring every call of the function as the stage.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.measure(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def end_frame(self):
+        """Keep the timings of the frame which has just finished, and start a new one.
+        """
+        frame = self.last = self.frame
+        self.frame = {}
+        self.frame_count += 1
+
+        if self.python:
+            self.history.append((self.frame_count, frame))
+
+            if (limit := spike_ms.get_value()) > 0 and (total := sum(frame.values()) * 1000) > limit:
+                stages = ', '.join(f'{k} {v * 1000:.2f}' for k, v in sorted(frame.items(), key=lambda x: -x[1]))
+                self.notify.warning(f'frame {self.frame_count} took {total:.2f} ms: {stages}')
+
+        return frame
+
+
+stage_timer = StageTimer()
+
+
+class RateCounter:
+    """Count things every frame, and the number of them per second over a window.
+       Args:
+            window (float): the seconds over which the rate is calculated;
+    """
+
+    def __init__(self, window=1.0):
+        self.window = window
+        self.elapsed = 0
+        self.count = 0
+        self.total = 0
+        self.last = 0
+        self.rate = 0
+
+    def add(self, n, dt):
+        self.last = n
+        self.total += n
+        self.count += n
+        self.elapsed += dt
+
+        if self.elapsed >= self.window:
+            self.rate = self.count / self.elapsed
+            self.count = 0
+            self.elapsed = 0
@@ -31,4 +31,10 @@ class BasicDayLight(NodePath):
         base.render.set_light(self)
         base.render.set_shader_auto()
         self.reparent_to(base.render)
-        # self.node().show_frustum()
\ No newline at end of file
+        # self.node().show_frustum()
+
+    def set_shadow_size(self, size):
+        """Change the size of the shadow map; the shadow buffer is made again.
+        """
+        if self.node().get_shadow_buffer_size() != (size, size):
+            self.node().set_shadow_caster(True, size, size)
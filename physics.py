@@ -0,0 +1,61 @@
+from panda3d.core import ConfigVariableDouble, ConfigVariableInt
+
+
+step_size = ConfigVariableDouble(
+    'physics-step-size', 1 / 60,
+    'The fixed time step of the physics simulation in seconds.')
+
+max_substeps = ConfigVariableInt(
+    'physics-max-substeps', 4,
+    'The maximum number of fixed steps simulated in one frame; the remaining time is dropped.')
+
+
+class PhysicsScheduler:
+    """Advance the physics in fixed time steps, carrying the leftover time to the next frame.
+       Args:
+            world (BulletWorld)
+            before_last_step (callable): called before the last step of a frame,
+                                         to keep the transforms to be interpolated from;
+    """
+
+    def __init__(self, world, before_last_step=None):
+        self.world = world
+        self.before_last_step = before_last_step
+        self.step_size = step_size.get_value()
+        self.max_substeps = max_substeps.get_value()
+        self.accumulator = 0
+        self.substeps = 0
+        self.dropped = 0
+
+    @property
+    def alpha(self):
+        """How far the rendering is between the last two steps (float from 0 to 1).
+        """
+        return self.accumulator / self.step_size
+
+    def reset(self):
+        self.accumulator = 0
+
+    def step(self, dt):
+        """Run as many fixed steps as the time dt allows, and return the number of them.
+        """
+        self.accumulator += dt
+        n = min(int(self.accumulator / self.step_size), self.max_substeps)
+
+        for i in range(n):
+            if i == n - 1 and self.before_last_step:
+                self.before_last_step()
+            # max_substeps 0 makes Bullet simulate exactly one step of step_size.
+            self.world.do_physics(self.step_size, 0)
+
+        self.accumulator -= n * self.step_size
+
+        # After a hitch, let the simulation slow down rather than try to catch up.
+        if self.accumulator >= self.step_size:
+            self.dropped = self.accumulator // self.step_size * self.step_size
+            self.accumulator -= self.dropped
+        else:
+            self.dropped = 0
+
+        self.substeps = n
+        return n
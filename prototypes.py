@@ -0,0 +1,89 @@
+from panda3d.core import NodePath, PandaNode
+
+from bam_cache import bam_cache, geom_params
+
+
+class PrototypeCache:
+    """Keep the geom nodes and bullet shapes of the prototypes, so that they are made only once
+       and shared by everything that uses the same primitive with the same parameters.
+       Entries used with an owner, such as the name of a tower class, can be evicted by releasing it;
+       entries used without an owner are kept until clear() is called.
+    """
+
+    def __init__(self):
+        self.geoms = {}
+        self.shapes = {}
+        # key -> names of the owners using the entry.
+        self.owners = {}
+        self.made = 0
+
+    def use(self, key, owner):
+        owners = self.owners.setdefault(key, set())
+        # None marks an entry which must not be evicted.
+        owners.add(owner)
+
+    def get_geom(self, geom_cls, owner=None, **params):
+        """Return the shared geom node of the primitive; do not set transforms or states on it.
+           Args:
+                geom_cls (class): a subclass of GeomRoot;
+                owner (str): the user of the geom node;
+                params: the arguments of geom_cls;
+        """
+        key = (geom_cls.__name__, geom_params(geom_cls, params))
+
+        if (node := self.geoms.get(key)) is None:
+            node = self.geoms[key] = bam_cache.load_geom(geom_cls, **params)
+            self.made += 1
+
+        self.use(key, owner)
+        return node
+
+    def get_model(self, geom_cls, owner=None, **params):
+        """Return a new NodePath with the shared geom node under it;
+           transforms, colors and textures can be set on the returned NodePath.
+        """
+        model = NodePath(PandaNode(geom_cls.__name__))
+        model.node().add_child(self.get_geom(geom_cls, owner, **params))
+        return model
+
+    def get_shape(self, primitive, scale, make, owner=None, **params):
+        """Return the shared bullet shape of the primitive.
+           Args:
+                primitive (str): the kind of the shape;
+                scale (Vec3): the scale of the bodies which the shape is added to;
+                make (callable): make the shape if it is not in the cache;
+                owner (str): the user of the shape;
+                params: the parameters which the shape is made from;
+        """
+        key = (primitive, tuple(sorted(params.items())), tuple(round(v, 6) for v in scale))
+
+        if (shape := self.shapes.get(key)) is None:
+            shape = self.shapes[key] = make()
+            self.made += 1
+
+        self.use(key, owner)
+        return shape
+
+    def release(self, owner):
+        """Stop the owner using the cache, and evict the entries no one else uses.
+           Return the number of the evicted entries.
+        """
+        evicted = 0
+
+        for key, owners in list(self.owners.items()):
+            owners.discard(owner)
+            if not owners:
+                del self.owners[key]
+                self.geoms.pop(key, None)
+                self.shapes.pop(key, None)
+                evicted += 1
+
+        return evicted
+
+    def clear(self):
+        self.geoms.clear()
+        self.shapes.clear()
+        self.owners.clear()
+
+
+prototypes = PrototypeCache()
@@ -0,0 +1,127 @@
+"""Replay the recorded sessions without a window, and write the time taken by each stage of their frames
+   to a JSON report, checking that the same blocks were removed in the same frames as when they were played.
+
+    python replay.py sessions/*.npz --output replay.json
+"""
+import argparse
+import functools
+import json
+import sys
+from collections import defaultdict
+
+import numpy as np
+from panda3d.core import Point3
+
+from benchmark import HeadlessGame, summarize
+from direct.showbase.ShowBaseGlobal import globalClock
+from session import SessionRecorder, CLICK, ROTATE, UNDO, REWIND, load
+
+
+class SessionReplay:
+    """Play the sessions again on a HeadlessGame, giving the recorded inputs at the recorded frames.
+       Args:
+            runner (HeadlessGame)
+    """
+
+    def __init__(self, runner):
+        self.runner = runner
+
+    def start(self, session):
+        """Build the tower of the session as it was built when played.
+        """
+        game = self.runner.game
+        game.drop_next_tower()
+        game.tower.remove_all_blocks()
+
+        game.start_screen.alpha = 1.0
+        game.start_screen.set_up()
+        game.session_recorder = SessionRecorder(seed=session.seed)
+        game.tower_num = session.tower_num
+        game.start_new_game()
+
+        if not session.intro:
+            self.runner.skip_intro()
+
+    def give(self, event):
+        """Have the next frame take the input where the game takes the input of the player.
+        """
+        game = self.runner.game
+        kind = event['kind']
+
+        if kind == CLICK:
+            ray = event['ray'].tolist()
+            game.request(functools.partial(game.navigator.set_h, event['heading']))
+            game.request(functools.partial(game.throw_ball, Point3(*ray[:3]), Point3(*ray[3:])))
+        elif kind == ROTATE:
+            game.request(functools.partial(game.navigator.set_h, event['heading']))
+        elif kind == UNDO:
+            game.request(game.undo_throw)
+        elif kind == REWIND:
+            game.request(game.rewind)
+
+    def play(self, session):
+        """Replay the session, and return its frames and whether the removals were reproduced.
+        """
+        game = self.runner.game
+        self.start(session)
+
+        events = defaultdict(list)
+        for event in session.events:
+            events[int(event['frame'])].append(event)
+
+        # Every block waiting is removed in a frame, unless it was not when played.
+        queued = dict(session.queued.tolist())
+        frames = []
+        for i, dt in enumerate(session.dt.tolist()):
+            for event in events[i]:
+                self.give(event)
+            game.removal_limit = queued.get(i, sys.maxsize)
+            globalClock.set_frame_rate(1 / dt)
+            frames.append(self.runner.step())
+        game.removal_limit = None
+
+        # The last frame of a finished tower begins the next one, which ends the session.
+        recorder = game.session_recorder
+        replayed = recorder.last if recorder.count > 1 else recorder.get_session()
+        matched = np.array_equal(replayed.removals, session.removals)
+
+        return {
+            'tower': session.tower,
+            'seed': session.seed,
+            'frames': frames,
+            'summary': summarize(frames),
+            'events': len(session.events),
+            'removals': len(session.removals),
+            'replayed_removals': len(replayed.removals),
+            'matched': matched,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay the recorded sessions without a window.')
+    parser.add_argument('paths', nargs='+', help='the session files')
+    parser.add_argument('--output', default='replay.json')
+    args = parser.parse_args()
+
+    replay = SessionReplay(HeadlessGame())
+    report = {'startup': replay.runner.startup, 'sessions': {}}
+    mismatched = 0
+
+    for path in args.paths:
+        result = replay.play(load(path))
+        report['sessions'][path] = result
+        mismatched += not result['matched']
+        print(f"{path}: {result['tower']}, {len(result['frames'])} frames, "
+              f"frame p95 {result['summary']['frame']['p95']:.2f} ms, "
+              f"removals {result['replayed_removals']}/{result['removals']} "
+              f"{'matched' if result['matched'] else 'MISMATCHED'}")
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f)
+
+    if mismatched:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,121 +1,227 @@
-from panda3d.bullet import BulletRigidBodyNode
-from panda3d.bullet import BulletPlaneShape, BulletConvexHullShape
-from panda3d.core import Vec3, Point3, BitMask32, CardMaker
-from panda3d.core import PandaNode, NodePath, TransparencyAttrib, CullFaceAttrib
-from panda3d.core import Shader
-from panda3d.core import Texture
-from panda3d.core import Plane, PlaneNode
-
-from create_geomnode import CylinderGeom
-
-
-PATH_SKY = 'models/blue-sky/blue-sky-sphere'
-TEXTURE_STONE = 'textures/envir-rock1.jpg'
-
-
-class Foundation(NodePath):
-
-    def __init__(self):
-        super().__init__(BulletRigidBodyNode('foundation'))
-        stone = CylinderGeom()
-        stone.set_texture(
-            base.loader.load_texture(TEXTURE_STONE), 1)
-        stone.reparent_to(self)
-
-        shape = BulletConvexHullShape()
-        shape.add_geom(stone.node().get_geom(0))
-        self.node().add_shape(shape)
-
-        self.set_scale(20)
-        self.set_collide_mask(BitMask32.bit(2))
-        self.set_pos(Point3(0, 0, -15))
-
-
-class Sky(NodePath):
-
-    def __init__(self):
-        super().__init__(PandaNode('sky'))
-        sky = base.loader.load_model(PATH_SKY)
-        sky.set_color(2, 2, 2, 1)
-        sky.set_scale(0.02)
-        sky.reparent_to(self)
-
-
-class WaterBottom(NodePath):
-
-    def __init__(self):
-        super().__init__(BulletRigidBodyNode('water_bottom'))
-        self.set_collide_mask(BitMask32.bit(4))
-        self.node().add_shape(BulletPlaneShape(Vec3.up(), -10))
-
-
-class Scene(NodePath):
-
-    def __init__(self, world):
-        super().__init__(PandaNode('scene'))
-        self.sky = Sky()
-        self.sky.reparent_to(self)
-
-        self.foundation = Foundation()
-        self.foundation.reparent_to(self)
-        world.attach(self.foundation.node())
-
-        self.bottom = WaterBottom()
-        self.bottom.reparent_to(self)
-        world.attach(self.bottom.node())
-
-        self.create_water()
-
-    def create_water(self):
-        size = 512  # size of the wave buffer
-        cm = CardMaker('plane')
-        cm.set_frame(0, 256, 0, 256)
-        self.water_plane = base.render.attach_new_node(cm.generate())
-        self.water_plane.set_transparency(TransparencyAttrib.MAlpha)
-        self.water_plane.look_at(0, 0, -1)
-
-        self.water_plane.set_pos(Point3(-128, -128, 0))
-        self.water_plane.flatten_strong()
-        self.water_plane.set_shader(Shader.load(Shader.SL_GLSL, 'shaders/water_v.glsl', 'shaders/water_f.glsl'))
-        self.water_plane.set_shader_input('size', size)
-        self.water_plane.set_shader_input('normal_map', base.loader.load_texture('images/water_noise.png'))
-
-        light_pos = (-20, 300.0, 50.0, 500 * 500)    # (0, 128.0, 20.0, 500 * 500)
-        light_color = (0.9, 0.9, 0.9, 1.0)
-        self.water_plane.set_shader_input('light_pos', light_pos)
-        self.water_plane.set_shader_input('light_color', light_color)
-        self.water_plane.hide(BitMask32.bit(1))
-
-        self.water_buffer = base.win.make_texture_buffer('water', 512, 512)
-        self.water_buffer.set_clear_color(base.win.get_clear_color())
-        self.water_buffer.set_sort(-1)
-
-        self.water_camera = base.make_camera(self.water_buffer)
-        self.water_camera.reparent_to(base.render)
-        self.water_camera.node().set_lens(base.camLens)
-        self.water_camera.node().set_camera_mask(BitMask32.bit(1))
-
-        reflect_tex = self.water_buffer.get_texture()
-        reflect_tex.set_wrap_u(Texture.WMClamp)
-        reflect_tex.set_wrap_v(Texture.WMClamp)
-
-        self.clip_plane = Plane(Vec3(0, 0, 1), Point3(0, 0, -5))  # -4 and -5 are OK too. 
-        clip_plane_node = base.render.attach_new_node(PlaneNode('water', self.clip_plane))
-        tmp_node = NodePath('StateInitializer')
-        tmp_node.set_clip_plane(clip_plane_node)
-        tmp_node.set_attrib(CullFaceAttrib.make_reverse())
-
-        self.water_camera.node().set_initial_state(tmp_node.get_state())
-        self.water_plane.set_shader_input('camera', self.water_camera)
-        self.water_plane.set_shader_input('reflection', reflect_tex)
-
-
-# if __name__ == '__main__':
-#     base = ShowBase()
-#     base.disableMouse()
-#     base.camera.setPos(10, -40, 10)  # 20, -20, 5
-#     # base.camera.setPos(-2, 12, 30)  # 20, -20, 5
-#     # base.camera.setP(-80)
-#     base.camera.lookAt(-2, 12, 10)  # 5, 0, 3
-#     scene = Scene()
+from panda3d.bullet import BulletRigidBodyNode
+from panda3d.bullet import BulletPlaneShape, BulletConvexHullShape
+from panda3d.core import Vec3, Point3, BitMask32, CardMaker
+from panda3d.core import PandaNode, NodePath, TransparencyAttrib, CullFaceAttrib
+from panda3d.core import Shader
+from panda3d.core import Texture
+from panda3d.core import Plane, PlaneNode
+from panda3d.core import ConfigVariableDouble, ConfigVariableInt
+
+from bam_cache import bam_cache
+from create_geomnode import CylinderGeom
+from prototypes import prototypes
+
+
+PATH_SKY = 'models/blue-sky/blue-sky-sphere'
+TEXTURE_STONE = 'textures/envir-rock1.jpg'
+
+max_reflection_size = ConfigVariableInt(
+    'reflection-size', 512,
+    'The largest size of the water reflection buffer.')
+
+min_reflection_interval = ConfigVariableInt(
+    'reflection-interval', 1,
+    'The water reflection is rendered at most once every this number of frames.')
+
+reflection_threshold = ConfigVariableDouble(
+    'reflection-threshold', 0.01,
+    'The water reflection is rendered again when the camera or a block has moved more than this.')
+
+reflected_rows = ConfigVariableInt(
+    'reflection-rows', 0,
+    'If more than 0, only this number of rows from the top of the tower are reflected on the water.')
+
+
+class Foundation(NodePath):
+
+    def __init__(self):
+        super().__init__(BulletRigidBodyNode('foundation'))
+        stone = prototypes.get_model(CylinderGeom)
+        stone.set_texture(
+            base.loader.load_texture(TEXTURE_STONE), 1)
+        stone.reparent_to(self)
+
+        shape = BulletConvexHullShape()
+        shape.add_geom(stone.get_child(0).node().get_geom(0))
+        self.node().add_shape(shape)
+
+        self.set_scale(20)
+        self.set_collide_mask(BitMask32.bit(2))
+        self.set_pos(Point3(0, 0, -15))
+
+
+class Sky(NodePath):
+
+    def __init__(self):
+        super().__init__(PandaNode('sky'))
+        sky = bam_cache.load_model(PATH_SKY)
+        sky.set_color(2, 2, 2, 1)
+        sky.set_scale(0.02)
+        sky.reparent_to(self)
+
+
+class WaterBottom(NodePath):
+
+    def __init__(self, level=-10):
+        super().__init__(BulletRigidBodyNode('water_bottom'))
+        self.level = level
+        self.set_collide_mask(BitMask32.bit(4))
+        self.node().add_shape(BulletPlaneShape(Vec3.up(), level))
+
+    def get_level(self, other):
+        """Return the height of the sea bottom in the coordinate system of other.
+        """
+        return other.get_relative_point(self, Point3(0, 0, self.level)).z
+
+
+class Scene(NodePath):
+
+    def __init__(self):
+        super().__init__(PandaNode('scene'))
+        self.sky = Sky()
+        self.sky.reparent_to(self)
+
+        self.foundation = Foundation()
+        self.foundation.reparent_to(self)
+
+        self.bottom = WaterBottom()
+        self.bottom.reparent_to(self)
+
+        # Without a window, there is nothing to reflect the scene into.
+        self.water_camera = None
+        self.reflection_interval = min_reflection_interval.get_value()
+        self.reflection_count = 0
+        # the camera matrix, the tower, its revision and its block positions the reflection was last rendered with.
+        self.reflected = None
+        if base.win is not None:
+            self.create_water()
+
+    def attach(self, world):
+        """Attach the foundation and the sea bottom to the world.
+        """
+        world.attach(self.foundation.node())
+        world.attach(self.bottom.node())
+
+    def detach(self, world):
+        world.remove(self.foundation.node())
+        world.remove(self.bottom.node())
+
+    def create_water(self):
+        size = 512  # size of the wave buffer
+        cm = CardMaker('plane')
+        cm.set_frame(0, 256, 0, 256)
+        self.water_plane = base.render.attach_new_node(cm.generate())
+        self.water_plane.set_transparency(TransparencyAttrib.MAlpha)
+        self.water_plane.look_at(0, 0, -1)
+
+        self.water_plane.set_pos(Point3(-128, -128, 0))
+        self.water_plane.flatten_strong()
+        self.water_plane.set_shader(Shader.load(Shader.SL_GLSL, 'shaders/water_v.glsl', 'shaders/water_f.glsl'))
+        self.water_plane.set_shader_input('size', size)
+        self.water_plane.set_shader_input('normal_map', base.loader.load_texture('images/water_noise.png'))
+
+        light_pos = (-20, 300.0, 50.0, 500 * 500)    # (0, 128.0, 20.0, 500 * 500)
+        light_color = (0.9, 0.9, 0.9, 1.0)
+        self.water_plane.set_shader_input('light_pos', light_pos)
+        self.water_plane.set_shader_input('light_color', light_color)
+        self.water_plane.hide(BitMask32.bit(1))
+
+        buffer_size = max_reflection_size.get_value()
+        self.water_buffer = base.win.make_texture_buffer('water', buffer_size, buffer_size)
+        self.water_buffer.set_clear_color(base.win.get_clear_color())
+        self.water_buffer.set_sort(-1)
+
+        self.water_camera = base.make_camera(self.water_buffer)
+        self.water_camera.reparent_to(base.render)
+        self.water_camera.node().set_lens(base.camLens)
+        self.water_camera.node().set_camera_mask(BitMask32.bit(1))
+
+        reflect_tex = self.water_buffer.get_texture()
+        reflect_tex.set_wrap_u(Texture.WMClamp)
+        reflect_tex.set_wrap_v(Texture.WMClamp)
+
+        self.clip_plane = Plane(Vec3(0, 0, 1), Point3(0, 0, -5))  # -4 and -5 are OK too. 
+        clip_plane_node = base.render.attach_new_node(PlaneNode('water', self.clip_plane))
+        tmp_node = NodePath('StateInitializer')
+        tmp_node.set_clip_plane(clip_plane_node)
+        tmp_node.set_attrib(CullFaceAttrib.make_reverse())
+
+        self.water_camera.node().set_initial_state(tmp_node.get_state())
+        self.water_plane.set_shader_input('camera', self.water_camera)
+        self.water_plane.set_shader_input('reflection', reflect_tex)
+
+        # The blocks below the reflected rows are clipped off by the second plane.
+        self.rows_plane = None
+        if reflected_rows.get_value() > 0:
+            self.rows_plane = base.render.attach_new_node(PlaneNode('reflected_rows'))
+            tmp_node = NodePath('StateInitializer')
+            tmp_node.set_clip_plane(self.rows_plane)
+            self.water_camera.node().set_tag_state_key('reflection')
+            self.water_camera.node().set_tag_state('rows', tmp_node.get_state())
+            self.foundation.set_tag('reflection', 'rows')
+
+    def set_reflection(self, size, interval):
+        """Change the size of the reflection buffer, and render it at most once every interval frames;
+           reflection-size and reflection-interval are the limits.
+        """
+        self.reflection_interval = max(interval, min_reflection_interval.get_value())
+        size = min(size, max_reflection_size.get_value())
+
+        if self.water_camera is not None and self.water_buffer.get_size() != (size, size):
+            self.water_buffer.set_size(size, size)
+            self.reflected = None
+
+    def is_reflection_changed(self, camera_mat, tower):
+        if self.reflected is None:
+            return True
+
+        mat, reflected_tower, revision, positions = self.reflected
+        if reflected_tower is not tower or revision != tower.revision:
+            return True
+
+        threshold = reflection_threshold.get_value()
+        if not camera_mat.almost_equal(mat, threshold):
+            return True
+
+        # compared with the positions reflected, so that blocks creeping a little every step add up.
+        return tower.get_drift(positions) * tower.get_sx(base.render) > threshold
+
+    def update_reflection(self, camera, tower, moving=False):
+        """Render the reflection only if the camera or the tower has changed since it was last rendered.
+           Call this after the physics simulation of the frame.
+           Args:
+                camera (NodePath): the camera to be reflected;
+                tower (Tower): the tower being played;
+                moving (bool): True if something other than the tower is moving above the water;
+        """
+        if self.water_camera is None:
+            return
+
+        self.reflection_count += 1
+        active = False
+
+        if self.reflection_count >= self.reflection_interval:
+            camera_mat = camera.get_mat(base.render)
+
+            if active := moving or self.is_reflection_changed(camera_mat, tower):
+                self.reflection_count = 0
+                self.reflected = (camera_mat, tower, tower.revision, tower.copy_positions())
+                self.water_camera.set_mat(camera_mat * self.clip_plane.get_reflection_mat())
+
+                if self.rows_plane is not None:
+                    z = tower.block_h * (tower.tower_top - reflected_rows.get_value() + 0.5)
+                    bottom = base.render.get_relative_point(tower, Point3(0, 0, z))
+                    self.rows_plane.node().set_plane(Plane(Vec3(0, 0, 1), bottom))
+
+        self.water_buffer.set_active(active)
+
+
+# if __name__ == '__main__':
+#     base = ShowBase()
+#     base.disableMouse()
+#     base.camera.setPos(10, -40, 10)  # 20, -20, 5
+#     # base.camera.setPos(-2, 12, 30)  # 20, -20, 5
+#     # base.camera.setP(-80)
+#     base.camera.lookAt(-2, 12, 10)  # 5, 0, 3
+#     scene = Scene()
 #     base.run()
\ No newline at end of file
@@ -0,0 +1,173 @@
+import atexit
+import os
+import random
+import time
+from collections import namedtuple
+
+import numpy as np
+from panda3d.core import ConfigVariableFilename
+
+
+session_record_dir = ConfigVariableFilename(
+    'session-record-dir', '',
+    'The directory which every tower played is written to as a session file; if empty, nothing is recorded.')
+
+
+VERSION = 1
+
+# the kinds of the events.
+CLICK = 0
+ROTATE = 1
+UNDO = 2
+REWIND = 3
+
+# one record an input; the ray is from and to points in render coordinates.
+EVENT = np.dtype([
+    ('frame', '<i4'),
+    ('kind', 'u1'),
+    ('heading', '<f8'),
+    ('ray', '<f8', 6),
+])
+
+
+# intro is False if the tower was put in PLAY without the intro, as the headless runs do.
+Session = namedtuple('Session', 'seed tower_num tower dt events removals queued intro', defaults=(True,))
+
+
+def load(path):
+    """Return the Session read from the file.
+    """
+    with np.load(path) as data:
+        if int(data['version']) != VERSION:
+            raise ValueError(f'{path} is not a session of this version.')
+
+        return Session(
+            int(data['seed']), int(data['tower_num']), str(data['tower']),
+            data['dt'], data['events'], data['removals'], data['queued'],
+            bool(data['intro']) if 'intro' in data else True
+        )
+
+
+class SessionRecorder:
+    """Record the inputs of the tower being played, so that the play can be replayed without a window.
+       A session begins when a new tower is started, and is written when the next one begins or the game ends.
+       Args:
+            directory (str): where the sessions are written; if None, they are only kept in memory;
+            seed (int): the seed of the random module for every tower; if None, a new one is chosen each time;
+    """
+
+    def __init__(self, directory=None, seed=None):
+        self.directory = directory
+        self.fixed_seed = seed
+        self.count = 0
+        self.next_seed = None
+        self.seed = None
+        self.tower_num = None
+        self.tower = None
+        self.intro = True
+        # the session finished by the last begin().
+        self.last = None
+        self.clear()
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            atexit.register(self.save)
+
+    @classmethod
+    def from_config(cls):
+        """Return a SessionRecorder writing to session-record-dir, or None if it is not set.
+        """
+        if not (path := session_record_dir.get_value()):
+            return None
+        return cls(path.to_os_specific())
+
+    def clear(self):
+        self.dt = []
+        self.events = []
+        self.removals = []
+        # the frames whose removals ran out of the time budget, and the number of blocks removed in them.
+        self.queued = []
+        self.alive = None
+
+    @property
+    def frame(self):
+        """The index of the frame being played.
+        """
+        return len(self.dt) - 1
+
+    def new_seed(self):
+        """Seed the random module for building the next tower, and return the seed.
+           The next tower can be built while the last one is still being played.
+        """
+        seed = self.fixed_seed if self.fixed_seed is not None else random.SystemRandom().getrandbits(32)
+        random.seed(seed)
+        self.next_seed = seed
+        return seed
+
+    def begin(self, tower_num, tower):
+        """Write the last session, and begin the one of the tower.
+           Args:
+                tower_num (int): the index of the tower class;
+                tower (Tower): the tower built after new_seed;
+        """
+        self.last = self.get_session() if self.dt else None
+        self.save()
+        self.clear()
+        self.count += 1
+        self.seed = self.next_seed
+        self.tower_num = tower_num
+        self.tower = type(tower).__name__
+        self.intro = True
+
+    def skip_intro(self):
+        """Record that the tower being played was started without the intro.
+        """
+        self.intro = False
+
+    def tick(self, dt, alive):
+        """Count a frame; call this before anything of the frame happens.
+           Args:
+                dt (float): the time step of the frame;
+                alive (numpy.ndarray): which slots of the tower have blocks in the world;
+        """
+        if self.alive is not None:
+            for slot in np.flatnonzero(self.alive & ~alive).tolist():
+                self.removals.append((self.frame, slot))
+        self.alive = alive.copy()
+        self.dt.append(dt)
+
+    def record(self, kind, heading=0, from_pos=(0, 0, 0), to_pos=(0, 0, 0)):
+        """Record an input given in the frame being played.
+        """
+        self.events.append((self.frame, kind, heading, (*from_pos, *to_pos)))
+
+    def record_queued(self, removed):
+        """Record that the blocks waiting to be removed were left after removing some in the frame;
+           how many are removed in time depends on the machine, so a replay removes the same number.
+        """
+        self.queued.append((self.frame, removed))
+
+    def get_session(self):
+        """Return the session being recorded.
+        """
+        return Session(
+            self.seed, self.tower_num, self.tower,
+            np.array(self.dt, dtype=np.float64),
+            np.array(self.events, dtype=EVENT),
+            np.array(self.removals, dtype=np.int32).reshape(-1, 2),
+            np.array(self.queued, dtype=np.int32).reshape(-1, 2),
+            self.intro
+        )
+
+    def save(self):
+        """Write the session to the directory, if it has any frames.
+        """
+        if self.directory is None or not self.dt:
+            return None
+
+        session = self.get_session()
+        path = os.path.join(
+            self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{self.count:03d}-{session.tower}.npz")
+        np.savez_compressed(path, version=VERSION, **session._asdict())
+        self.clear()
+        return path
@@ -0,0 +1,29 @@
+#version 150
+
+uniform struct p3d_LightModelParameters {
+    vec4 ambient;
+} p3d_LightModel;
+
+uniform struct p3d_LightSourceParameters {
+    vec4 color;
+    vec4 position;
+    sampler2DShadow shadowMap;
+    mat4 shadowViewMatrix;
+} p3d_LightSource[1];
+
+in vec4 color;
+in vec3 normal;
+in vec4 shadow_coord;
+out vec4 p3d_FragColor;
+
+
+void main()
+    {
+    vec3 n = gl_FrontFacing ? normalize(normal) : -normalize(normal);
+    vec3 l = normalize(p3d_LightSource[0].position.xyz);
+    float diffuse = max(dot(n, l), 0.0);
+    float shadow = textureProj(p3d_LightSource[0].shadowMap, shadow_coord);
+
+    vec3 light = p3d_LightModel.ambient.rgb + p3d_LightSource[0].color.rgb * diffuse * shadow;
+    p3d_FragColor = vec4(color.rgb * light, color.a);
+    }
@@ -0,0 +1,43 @@
+#version 150
+
+uniform mat4 p3d_ModelViewProjectionMatrix;
+uniform mat4 p3d_ModelViewMatrix;
+uniform mat3 p3d_NormalMatrix;
+uniform vec4 p3d_ClipPlane[2];
+uniform samplerBuffer instances;
+
+uniform struct p3d_LightSourceParameters {
+    vec4 color;
+    vec4 position;
+    sampler2DShadow shadowMap;
+    mat4 shadowViewMatrix;
+} p3d_LightSource[1];
+
+in vec4 p3d_Vertex;
+in vec3 p3d_Normal;
+
+out vec4 color;
+out vec3 normal;
+out vec4 shadow_coord;
+
+
+void main()
+    {
+    // 3 rows of the model matrix and the color of this instance.
+    int i = gl_InstanceID * 4;
+    vec4 row0 = texelFetch(instances, i);
+    vec4 row1 = texelFetch(instances, i + 1);
+    vec4 row2 = texelFetch(instances, i + 2);
+    color = texelFetch(instances, i + 3);
+
+    vec4 pos = vec4(dot(row0, p3d_Vertex), dot(row1, p3d_Vertex), dot(row2, p3d_Vertex), 1.0);
+    mat3 normal_mat = inverse(mat3(row0.xyz, row1.xyz, row2.xyz));
+    normal = normalize(p3d_NormalMatrix * (normal_mat * p3d_Normal));
+
+    vec4 vpos = p3d_ModelViewMatrix * pos;
+    shadow_coord = p3d_LightSource[0].shadowViewMatrix * vpos;
+    // the water surface and, if reflection-rows is set, the lowest reflected row.
+    gl_ClipDistance[0] = dot(p3d_ClipPlane[0], vpos);
+    gl_ClipDistance[1] = dot(p3d_ClipPlane[1], vpos);
+    gl_Position = p3d_ModelViewProjectionMatrix * pos;
+    }
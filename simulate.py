@@ -0,0 +1,194 @@
+"""Play many games of every tower without a window across a pool of processes, and write the win rate
+   and the balls used per tower, and the rows cleared per second by each worker, to a JSON report.
+
+    python simulate.py --games 1000 --policy random --output simulation.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from benchmark import HeadlessGame
+from bot import AutoPlayer
+from tower import towers
+from towercrash import Game
+
+
+# the runner of the worker process, and the bot playing on it; a process can have only one ShowBase.
+runner = None
+player = None
+
+
+def random_click(runner, rng):
+    """Click a random point around the middle of the screen from a random camera heading.
+    """
+    runner.click(rng.uniform(0, 360), rng.uniform(-0.15, 0.15), rng.uniform(-0.2, 0.6))
+
+
+def bot_click(runner, rng):
+    """Throw the ball at the block clearing the most blocks, chosen by the AutoPlayer.
+    """
+    runner.request_throw(player.throw)
+
+
+# the click policies selectable by name; a policy is called with the HeadlessGame and a random.Random
+# whenever a ball can be thrown, and requests a throw of the next frame from the HeadlessGame.
+POLICIES = {
+    'random': random_click,
+    'bot': bot_click,
+}
+
+
+def init_worker(dt, settle):
+    global runner, player
+    runner = HeadlessGame(dt=dt, settle=settle)
+    player = AutoPlayer(runner.game)
+
+
+def play(tower_num, seed, policy, max_frames):
+    """Play a game of the tower in the worker, and return its result.
+       Args:
+            tower_num (int): the index of the tower class;
+            seed (int): the seed of the tower build and the policy;
+            policy (str): the name of the click policy;
+            max_frames (int): the game is given up after these frames;
+    """
+    start = time.perf_counter()
+    game = runner.game
+    click = POLICIES[policy]
+    rng = random.Random(seed)
+
+    runner.seed = seed
+    runner.start_tower(tower_num)
+    rows = game.tower.tower_top
+    wait = runner.settle
+    frames = missed = 0
+
+    # A tower brought down to its foundation is won, even if no ball is left to throw for the judge.
+    while frames < max_frames and game.state != Game.GAMEOVER and game.tower.tower_top > 1:
+        if clicked := game.state == Game.PLAY and (wait := wait - 1) <= 0:
+            click(runner, rng)
+        game.taskMgr.step()
+        frames += 1
+
+        if clicked:
+            if runner.thrown:
+                wait = runner.settle
+            else:
+                missed += 1
+
+    return {
+        'tower': towers[tower_num].__name__,
+        'seed': seed,
+        'won': game.tower.tower_top <= 1,
+        'finished': game.state == Game.GAMEOVER or game.tower.tower_top <= 1,
+        'balls_used': game.tower.level - game.ball_cnt,
+        'clicks_missed': missed,
+        'rows': rows - game.tower.tower_top,
+        'frames': frames,
+        'seconds': time.perf_counter() - start,
+        'worker': os.getpid(),
+    }
+
+
+def play_args(args):
+    return play(*args)
+
+
+def aggregate(results):
+    """Return the statistics per tower and per worker of the results of play.
+    """
+    by_tower = defaultdict(list)
+    by_worker = defaultdict(list)
+    for result in results:
+        by_tower[result['tower']].append(result)
+        by_worker[result['worker']].append(result)
+
+    report = {'towers': {}, 'workers': {}}
+
+    for name, games in by_tower.items():
+        balls = np.array([g['balls_used'] for g in games])
+        won = np.array([g['won'] for g in games])
+        report['towers'][name] = {
+            'games': len(games),
+            'level': next(t.level for t in towers if t.__name__ == name),
+            'win_rate': float(won.mean()),
+            'unfinished': sum(not g['finished'] for g in games),
+            'balls_used': {
+                'mean': float(balls.mean()),
+                'p50': float(np.percentile(balls, 50)),
+                'p95': float(np.percentile(balls, 95)),
+            },
+            # how many balls a won game needed; None if none was won.
+            'balls_to_win': float(balls[won].mean()) if won.any() else None,
+        }
+
+    for pid, games in by_worker.items():
+        seconds = sum(g['seconds'] for g in games)
+        report['workers'][str(pid)] = {
+            'games': len(games),
+            'seconds': seconds,
+            'rows_per_second': sum(g['rows'] for g in games) / seconds,
+            'frames_per_second': sum(g['frames'] for g in games) / seconds,
+        }
+
+    return report
+
+
+def simulate(tower_nums, games, policy='random', seed=0, workers=None, dt=1 / 60, settle=60, max_frames=20000):
+    """Play the games of every tower on a pool of worker processes, and return the aggregated report.
+       Every game is built from its own seed in a new BulletWorld,
+       so the results do not depend on which worker played it.
+       Args:
+            tower_nums (list): the indices of the tower classes;
+            games (int): the number of games per tower;
+            policy (str): the name of the click policy in POLICIES;
+            workers (int): the number of processes; the number of CPUs if None;
+    """
+    tasks = [(n, seed + i, policy, max_frames) for n in tower_nums for i in range(games)]
+    # spawned, so that no Panda3D state is inherited from the parent.
+    context = multiprocessing.get_context('spawn')
+    start = time.perf_counter()
+
+    with context.Pool(workers, initializer=init_worker, initargs=(dt, settle)) as pool:
+        # a game takes seconds, so they are handed out one at a time to keep the workers busy.
+        results = list(pool.imap_unordered(play_args, tasks))
+
+    report = aggregate(results)
+    report.update(policy=policy, games=games, seed=seed, seconds=time.perf_counter() - start)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Play many games of the towers without a window.')
+    parser.add_argument('--games', type=int, default=100, help='the number of games per tower')
+    parser.add_argument('--policy', default='random', choices=sorted(POLICIES))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, help='the number of processes; the number of CPUs by default')
+    parser.add_argument('--frames', type=int, default=20000, help='the maximum number of frames per game')
+    parser.add_argument('--dt', type=float, default=1 / 60)
+    parser.add_argument('--settle', type=int, default=60, help='the frames to wait after a ball has hit the tower')
+    parser.add_argument('--towers', nargs='*', help='the class names of the towers; all towers by default')
+    parser.add_argument('--output', default='simulation.json')
+    args = parser.parse_args()
+
+    tower_nums = [i for i, t in enumerate(towers) if not args.towers or t.__name__ in args.towers]
+    report = simulate(tower_nums, args.games, args.policy, args.seed, args.workers, args.dt, args.settle, args.frames)
+
+    for name, stats in report['towers'].items():
+        print(f"{name}: {stats['games']} games, win rate {stats['win_rate']:.2f}, "
+              f"balls used {stats['balls_used']['mean']:.1f}/{stats['level']}")
+    for pid, stats in report['workers'].items():
+        print(f"worker {pid}: {stats['games']} games, {stats['rows_per_second']:.1f} rows/s")
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f)
+
+
+if __name__ == '__main__':
+    main()
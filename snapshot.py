@@ -0,0 +1,112 @@
+import struct
+from collections import deque, namedtuple
+
+import numpy as np
+from panda3d.core import ConfigVariableInt
+
+
+snapshot_interval = ConfigVariableInt(
+    'snapshot-interval', 15,
+    'The number of frames between the snapshots kept to rewind the tower; 0 keeps none.')
+
+snapshot_ring = ConfigVariableInt(
+    'snapshot-ring', 32,
+    'The number of the recent snapshots kept to rewind the tower.')
+
+
+MAGIC = b'TCSN'
+VERSION = 1
+
+# magic, version, tower_top, inactive_top, floater z, ball_cnt, ball kind, twotone used, number of blocks
+HEADER = struct.Struct('<4sBhhfhbBI')
+
+# one record a block slot of the tower.
+RECORD = np.dtype([
+    ('pos', '<f4', 3),
+    ('quat', '<f4', 4),
+    ('linear', '<f4', 3),
+    ('angular', '<f4', 3),
+    ('mass', '<f4'),
+    ('color', 'i1'),
+    ('flags', 'u1'),
+])
+
+ALIVE = 1
+AWAKE = 2
+ACTIVE = 4
+
+
+Snapshot = namedtuple(
+    'Snapshot',
+    'tower_top inactive_top floater_z records ball_cnt ball_kind twotone_used',
+    defaults=(0, -1, False)
+)
+
+
+def pack(snapshot):
+    """Return the snapshot as bytes.
+    """
+    header = HEADER.pack(
+        MAGIC, VERSION, snapshot.tower_top, snapshot.inactive_top, snapshot.floater_z,
+        snapshot.ball_cnt, snapshot.ball_kind, snapshot.twotone_used, len(snapshot.records)
+    )
+    return header + snapshot.records.astype(RECORD, copy=False).tobytes()
+
+
+def unpack(data):
+    """Return the Snapshot read from the bytes.
+    """
+    magic, version, tower_top, inactive_top, floater_z, ball_cnt, ball_kind, twotone_used, count = \
+        HEADER.unpack_from(data)
+
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('The data is not a snapshot of this version.')
+
+    records = np.frombuffer(data, dtype=RECORD, count=count, offset=HEADER.size)
+    return Snapshot(tower_top, inactive_top, floater_z, records, ball_cnt, ball_kind, bool(twotone_used))
+
+
+class SnapshotRing:
+    """Keep the recent snapshots, taking one every interval frames.
+       Args:
+            interval (int): the number of frames between the snapshots; 0 takes none;
+            size (int): the number of the snapshots kept;
+    """
+
+    def __init__(self, interval=15, size=32):
+        self.interval = interval
+        self.snapshots = deque(maxlen=size)
+        self.count = 0
+
+    @classmethod
+    def from_config(cls):
+        return cls(snapshot_interval.get_value(), snapshot_ring.get_value())
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    def tick(self, take):
+        """Count a frame, and keep the bytes returned by take on every interval-th frame.
+           Args:
+                take (callable): return a snapshot;
+        """
+        if not self.interval:
+            return
+
+        self.count += 1
+        if self.count >= self.interval:
+            self.count = 0
+            self.snapshots.append(take())
+
+    def pop(self):
+        """Return the newest snapshot and drop it, or None if there is none.
+        """
+        if not self.snapshots:
+            return None
+
+        self.count = 0
+        return self.snapshots.pop()
+
+    def clear(self):
+        self.snapshots.clear()
+        self.count = 0
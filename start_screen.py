@@ -21,8 +21,8 @@ class StartScreen:
         self.color_plane.set_shader(
             Shader.load(Shader.SL_GLSL, 'shaders/color_v.glsl', 'shaders/color_f.glsl')
         )
-        props = base.win.get_properties()
-        self.color_plane.set_shader_input('u_resolution', props.get_size())
+        if base.win is not None:
+            self.color_plane.set_shader_input('u_resolution', base.win.get_size())
         self.color_plane.set_shader_input('alpha', self.alpha)
 
     def set_up(self):
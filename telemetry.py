@@ -0,0 +1,151 @@
+"""Write one JSON record per frame of the game, and summarize the records offline.
+
+    python telemetry.py telemetry.jsonl
+"""
+import argparse
+import atexit
+import json
+import queue
+import threading
+from collections import defaultdict
+
+import numpy as np
+from panda3d.core import ConfigVariableFilename, ConfigVariableInt
+
+
+telemetry_file = ConfigVariableFilename(
+    'telemetry-file', '',
+    'The JSONL file which the records of every frame are written to; if empty, nothing is recorded.')
+
+telemetry_buffer = ConfigVariableInt(
+    'telemetry-buffer', 120,
+    'The number of records passed to the writer thread at a time.')
+
+
+class TelemetryWriter:
+    """Buffer the records, and write them to a JSONL file on a background thread,
+       so that the frames do not wait for encoding and writing.
+       Args:
+            path (str): the output file;
+            buffer_size (int): the number of records passed to the thread at a time;
+    """
+
+    def __init__(self, path, buffer_size=120):
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.queue = queue.Queue()
+        self.file = open(path, 'w')
+        self.thread = threading.Thread(target=self.run, name='telemetry', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def run(self):
+        while (records := self.queue.get()) is not None:
+            self.file.write(''.join(json.dumps(r, separators=(',', ':')) + '\n' for r in records))
+        self.file.close()
+
+    def write(self, record):
+        self.buffer.append(record)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.queue.put(self.buffer)
+            self.buffer = []
+
+    def close(self):
+        if self.thread.is_alive():
+            self.flush()
+            self.queue.put(None)
+            self.thread.join()
+
+
+class Telemetry:
+    """Make the record of a frame from the state of the game.
+       Args:
+            writer (TelemetryWriter)
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.frame = 0
+
+    @classmethod
+    def from_config(cls):
+        """Return a Telemetry writing to telemetry-file, or None if it is not set.
+        """
+        if not (path := telemetry_file.get_value()):
+            return None
+        return cls(TelemetryWriter(path.to_os_specific(), telemetry_buffer.get_value()))
+
+    def record(self, game, dt, frame_time, stages):
+        """Args:
+                game (TowerCrash)
+                dt (float): the time step of the frame;
+                frame_time (float): the seconds the frame took;
+                stages (dict): the seconds each stage of the frame took;
+        """
+        tower = game.tower
+        self.frame += 1
+        self.writer.write({
+            'frame': self.frame,
+            'tower': type(tower).__name__,
+            'state': game.state.name if game.state else None,
+            'dt': round(dt, 6),
+            'frame_ms': round(frame_time * 1000, 3),
+            'active': len(tower.awake),
+            'blocks': len(tower.block_index),
+            'tower_top': tower.tower_top,
+            'inactive_top': tower.inactive_top,
+            'bubbles': game.ball.bubbles.count,
+            'culled': game.culled.last,
+            'culled_per_second': round(game.culled.rate, 3),
+            'substeps': game.physics.substeps,
+            'dropped_ms': round(game.physics.dropped * 1000, 3),
+            'stages': {k: round(v * 1000, 3) for k, v in stages.items()},
+        })
+
+    def close(self):
+        self.writer.close()
+
+
+def summarize(path):
+    """Return the frame count and the p50, p95 and p99 of the frame time in milliseconds
+       and the largest active body count for each tower class in the JSONL file.
+    """
+    frame_ms = defaultdict(list)
+    active = defaultdict(int)
+
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            frame_ms[record['tower']].append(record['frame_ms'])
+            active[record['tower']] = max(active[record['tower']], record['active'])
+
+    summary = {}
+    for tower, values in frame_ms.items():
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        summary[tower] = {
+            'frames': len(values),
+            'p50': float(p50),
+            'p95': float(p95),
+            'p99': float(p99),
+            'max_active': active[tower],
+        }
+
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize the frame times of a telemetry file per tower.')
+    parser.add_argument('path')
+    args = parser.parse_args()
+
+    print(f"{'tower':<16}{'frames':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'active':>8}")
+    for tower, s in summarize(args.path).items():
+        print(f"{tower:<16}{s['frames']:>8}{s['p50']:>10.2f}{s['p95']:>10.2f}{s['p99']:>10.2f}{s['max_active']:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,29 @@
 import itertools
 import math
 import random
+import time
+from collections import deque
 from enum import Enum
 
+import numpy as np
 from panda3d.bullet import BulletCylinderShape, BulletBoxShape, BulletConvexHullShape
 from panda3d.bullet import BulletRigidBodyNode
-from panda3d.core import PandaNode, NodePath, TransformState
-from panda3d.core import Vec3, LColor, BitMask32, Point3
+from panda3d.core import PandaNode, NodePath, TransformState, ConfigVariableDouble
+from panda3d.core import Vec3, LColor, BitMask32, Point3, Quat
 
+from block_table import BlockTable
 from create_geomnode import CylinderGeom, CubeGeom, TriangularPrismGeom
+from instancing import BlockInstances
+from prototypes import prototypes
+from snapshot import Snapshot, RECORD, ALIVE, AWAKE, ACTIVE, pack, unpack
 
 
 towers = []
 
+removal_budget = ConfigVariableDouble(
+    'block-removal-budget', 0.002,
+    'The time in seconds a frame can spend removing cleaned up blocks from the world.')
+
 
 class Colors(int, Enum):
 
@@ -30,13 +41,18 @@ class Colors(int, Enum):
         obj.rgba = rgba
         return obj
 
+    @classmethod
+    def random_color(cls):
+        """Randomly choose a color except for GRAY to return it (Colors).
+        """
+        n = random.randint(0, 5)
+        return cls(n)
+
     @classmethod
     def random_select(cls):
         """Randomly choose a color except for GRAY to return it (LVecBase4f).
         """
-        n = random.randint(0, 5)
-        color = cls(n)
-        return color.rgba
+        return cls.random_color().rgba
 
     @classmethod
     def get_rgba(cls, n):
@@ -59,16 +75,57 @@ class Tower(NodePath):
         self.tower_top = self.rows - 1
         self.inactive_top = self.rows - 9
 
+        # blocks[row][col] -> block, and block node -> (row, col, color id).
+        self.table = [[None] * self.cols for _ in range(self.rows)]
+        self.block_index = {}
+        # the number of blocks left in each row, and the blocks that can move.
+        self.row_counts = [0] * self.rows
+        self.awake = set()
+        # positions, orientations and colors of the blocks in arrays, read from Bullet once a frame.
+        self.states = BlockTable()
+        # the cleaned up blocks waiting to be removed from the world.
+        self.removals = deque()
+        # incremented when a block is colored or taken out, so that views of the tower can tell it changed.
+        self.revision = 0
+
         self.floater = NodePath('floater')
         self.floater.reparent_to(self)
+        # The blocks are only rigid bodies; they are drawn by the instanced geoms.
         self.blocks = NodePath('blocks')
         self.blocks.reparent_to(self)
+        self.blocks.hide()
+        self.instances = {}
+
+        # The inactive rows are merged into one static body; block node -> shape in it.
+        self.merged = NodePath(BulletRigidBodyNode('merged_rows'))
+        self.merged.set_collide_mask(BitMask32.bit(1) | BitMask32.bit(2) | BitMask32.bit(4))
+        self.merged_shapes = {}
 
         self.set_pos(pos)
         self.reparent_to(self.foundation)
 
     def build(self):
-        self.build_tower()
+        for _ in self.build_steps():
+            pass
+        self.start()
+
+    def build_steps(self):
+        """Build the tower a row at a time; build_tower yields after each row.
+           Nothing is attached to the world until start() is called.
+        """
+        yield from self.build_tower()
+
+        # Shapes have to be added before the body gets the scale of the foundation.
+        for r in range(self.inactive_top, -1, -1):
+            for block in self.find_blocks(r):
+                self.merge(block)
+            yield
+        self.merged.reparent_to(self.blocks)
+
+    def start(self):
+        if self.merged_shapes:
+            self.world.attach(self.merged.node())
+
         # Activate blocks in 8 rows from the top.
         for r in range(self.tower_top, self.inactive_top, -1):
             for block in self.find_blocks(r):
@@ -78,77 +135,432 @@ class Tower(NodePath):
         # self.floater.set_z(block.get_z() - self.block_h)
         self.floater.set_z(block.get_z())
 
-    def attach_block(self, block):
+    def attach_block(self, block, row, col):
+        if (instances := self.instances.get(name := block.get_name())) is None:
+            instances = BlockInstances(name, block.get_child(0))
+            instances.reparent_to(self)
+            self.instances[name] = instances
+        instances.add(block, Colors.GRAY.rgba)
+
+        self.table[row][col] = block
+        self.block_index[block.node()] = (row, col, Colors.GRAY)
+        self.states.add(block, row, col, Colors.GRAY)
+        self.row_counts[row] += 1
+
+    def activate(self, block, color=None):
+        row, col, _ = self.block_index[block.node()]
+        color = Colors.random_color() if color is None else color
+        self.block_index[block.node()] = (row, col, color)
+        self.states.wake(block, color)
+        self.instances[block.get_name()].set_color(block, color.rgba)
+        self.revision += 1
+
+        self.unmerge(block)
+        block.node().deactivation_enabled = False
+        block.node().set_mass(1)
         self.world.attach(block.node())
+        self.awake.add(block)
+
+    def settle(self, block):
+        """Stop the block and merge it back into the static body; the inverse of activate.
+        """
+        row, col, _ = self.block_index[block.node()]
+        self.block_index[block.node()] = (row, col, Colors.GRAY)
+        self.states.sleep(block, Colors.GRAY)
+        instances = self.instances[block.get_name()]
+        instances.set_color(block, Colors.GRAY.rgba)
+        instances.write(block)
+        self.revision += 1
+
+        self.world.remove(block.node())
         block.node().set_mass(0)
-        block.node().deactivation_enabled = True
+        self.awake.discard(block)
+        self.merge(block)
 
-    def activate(self, block):
-        block.clear_color()
-        block.set_color(Colors.random_select())
-        block.node().deactivation_enabled = False
-        block.node().set_mass(1)
+    def revive(self, slot):
+        """Put the cleaned up block in the slot back to the tower as an inactive block;
+           it is not merged or attached to the world.
+        """
+        block = NodePath(self.states.nodes[slot])
+        row = int(self.states.row[slot])
+        col = int(self.states.col[slot])
+
+        block.reparent_to(self.blocks)
+        block.node().set_into_collide_mask(BitMask32.bit(1) | BitMask32.bit(2) | BitMask32.bit(4))
+        block.node().set_mass(0)
+        self.instances[block.get_name()].add(block, Colors.GRAY.rgba)
+        self.states.revive(block, Colors.GRAY)
+
+        self.table[row][col] = block
+        self.block_index[block.node()] = (row, col, Colors.GRAY)
+        self.row_counts[row] += 1
+        self.revision += 1
+        return block
+
+    def merge(self, block):
+        """Add a copy of the block's shape to the merged static body.
+           A copied shape has the size it was created with, so the block's scale is applied to it;
+           shapes in a compound do not follow the scale of the block.
+        """
+        shape = type(block.node().get_shape(0))(block.node().get_shape(0))
+
+        if isinstance(shape, (BulletBoxShape, BulletCylinderShape)):
+            scale = block.get_scale()
+            half = Vec3(*(h * s for h, s in zip(shape.get_half_extents_with_margin(), scale)))
+            shape = type(shape)(half)
+
+        self.merged.node().add_shape(shape, TransformState.make_pos_hpr(block.get_pos(), block.get_hpr()))
+        self.merged_shapes[block.node()] = shape
+
+    def unmerge(self, block):
+        """Remove the block's shape from the merged static body, and return True if it was there.
+           An empty compound must not stay in the world, so the body is removed with its last shape.
+        """
+        if (shape := self.merged_shapes.pop(block.node(), None)) is None:
+            return False
+
+        self.merged.node().remove_shape(shape)
+        # Removing a shape activates the body, which would let it be chosen as a block.
+        self.merged.node().set_active(False, True)
+        if not self.merged_shapes:
+            self.world.remove(self.merged.node())
+        return True
+
+    def get_block(self, row, col):
+        return self.table[row][col]
+
+    def get_info(self, block):
+        """Return (row, col, color id) of the block, or None if it has been removed.
+        """
+        return self.block_index.get(block.node())
+
+    def get_color(self, block):
+        """Return the color id (Colors) of the block, or None if it has been removed.
+        """
+        if (info := self.block_index.get(block.node())) is not None:
+            return info[2]
 
     def find_blocks(self, row):
-        for i in range(self.cols):
-            name = str(row * self.cols + i)
-            if not (block := self.blocks.find(name)).is_empty():
+        for block in self.table[row]:
+            if block is not None:
                 yield block
 
+    def get_inactive_top_z(self):
+        """Return the height of the highest inactive row having blocks, or None.
+        """
+        for row in range(self.inactive_top, -1, -1):
+            if self.row_counts[row]:
+                return next(self.find_blocks(row)).get_z()
+
     def update(self):
-        try:
-            top_block = max(
-                (b for b in self.blocks.get_children() if b.node().is_active()),
-                key=lambda x: x.get_z()
-            )
-            top_row = int(top_block.get_z() / self.block_h) + 1
-
-            if (activate_rows := self.tower_top - top_row) > 0:
-                for _ in range(activate_rows):
-                    if self.inactive_top >= 0:
+        """Only the activated blocks can change their height, so the top of the tower
+           is found from them and the highest inactive row, which does not move.
+        """
+        heights = [z] if (z := self.states.get_highest()) is not None else []
+        if (inactive_z := self.get_inactive_top_z()) is not None:
+            heights.append(inactive_z)
+
+        if not heights:
+            return
+
+        top_row = int(max(heights) / self.block_h) + 1
+
+        if (activate_rows := self.tower_top - top_row) > 0:
+            for _ in range(activate_rows):
+                if self.inactive_top >= 0:
+                    if self.row_counts[self.inactive_top]:
                         for block in self.find_blocks(self.inactive_top):
                             self.activate(block)
-                        self.inactive_top -= 1
-                        self.floater.set_z(self.floater.get_z() - self.block_h)
+                    self.inactive_top -= 1
+                    self.floater.set_z(self.floater.get_z() - self.block_h)
 
-                self.tower_top = top_row
-        except ValueError:
-            pass
+            self.tower_top = top_row
+
+    def find_fallen(self, bottom_z):
+        """Return the activated blocks which have reached the height bottom_z;
+           a block is judged by the height of its center and the radius of its bounding sphere.
+           Args:
+                bottom_z (float): the height in the coordinate system of the blocks;
+        """
+        return self.states.find_below(bottom_z)
+
+    def keep_previous(self):
+        """Keep the transforms of the moving blocks before the last physics step.
+        """
+        self.states.keep_previous()
+
+    def get_motion(self):
+        """Return the longest distance a moving block went in the last physics step,
+           in the coordinate system of the blocks.
+        """
+        return self.states.get_motion()
+
+    def copy_positions(self):
+        """Return a copy of the positions of the blocks, to be compared later by get_drift.
+        """
+        return self.states.pos.copy()
+
+    def get_drift(self, positions):
+        """Return the longest distance a moving block has gone since copy_positions returned the positions,
+           in the coordinate system of the blocks. The positions must be copied after the last revision.
+        """
+        return self.states.get_drift(positions)
+
+    def get_positions(self, blocks):
+        """Return the positions of the blocks in the coordinate system of render as a list of Point3.
+        """
+        if not blocks:
+            return []
+
+        mat = np.array(self.blocks.get_mat(base.render), dtype=np.float32)
+        pos = self.states.get_positions(blocks) @ mat[:3, :3] + mat[3, :3]
+        return [Point3(*p) for p in pos.tolist()]
+
+    def sync(self, alpha=1.0):
+        """Read the moving blocks from Bullet, and copy their transforms to the instanced geoms.
+           Call this after the physics simulation of the frame.
+           Args:
+                alpha (float): how far the rendering is from the previous step to the last one;
+        """
+        states = self.states
+        slots = states.refresh()
+        rows = states.get_rows(slots, alpha)
+        kinds = states.kind[slots]
+
+        for kind, name in enumerate(states.names):
+            if (selected := kinds == kind).any():
+                self.instances[name].write_rows([states.nodes[i] for i in slots[selected]], rows[selected])
+
+        for instances in self.instances.values():
+            instances.upload()
+
+    def snapshot(self, **game):
+        """Return the state of the tower and its blocks as bytes.
+           The transforms are the ones read by the last sync.
+           Args:
+                game: ball_cnt, ball_kind and twotone_used of the game, kept with the tower;
+        """
+        states = self.states
+        n = states.size
+        records = np.zeros(n, dtype=RECORD)
+        records['pos'] = states.pos[:n]
+        records['quat'] = states.quat[:n]
+        records['color'] = states.color[:n]
+        records['flags'] = states.alive[:n] * ALIVE | states.awake[:n] * AWAKE
+
+        if len(slots := np.flatnonzero(states.awake[:n])):
+            nodes = [states.nodes[i] for i in slots]
+            values = np.fromiter(
+                itertools.chain.from_iterable(
+                    [(*nd.get_linear_velocity(), *nd.get_angular_velocity(), nd.get_mass(), nd.is_active())
+                     for nd in nodes]),
+                dtype=np.float32,
+                count=len(nodes) * 8
+            ).reshape(-1, 8)
+
+            records['linear'][slots] = values[:, :3]
+            records['angular'][slots] = values[:, 3:6]
+            records['mass'][slots] = values[:, 6]
+            records['flags'][slots] |= np.where(values[:, 7] > 0, ACTIVE, 0).astype(np.uint8)
+
+        return pack(Snapshot(self.tower_top, self.inactive_top, self.floater.get_z(), records, **game))
+
+    def restore(self, data):
+        """Put the tower back to the snapshot in place, without making nodes, and return the Snapshot.
+           Args:
+                data (bytes): made by snapshot() of this tower;
+        """
+        snapshot = unpack(data)
+        records = snapshot.records
+        states = self.states
+
+        if len(records) != (n := states.size):
+            raise ValueError(f'The snapshot has {len(records)} blocks, but the tower has {n}.')
+
+        alive = (records['flags'] & ALIVE) > 0
+        awake = (records['flags'] & AWAKE) > 0
+        self.remove_queued(0)
+
+        for i in np.flatnonzero(states.alive[:n] & ~alive):
+            self.clean_up(states.blocks[i])
+        self.remove_queued(0)
+
+        # Blocks leave the merged body first, so that it is in the world as long as it has shapes.
+        for i in np.flatnonzero(states.alive[:n] & ~states.awake[:n] & awake):
+            self.activate(states.blocks[i], Colors(records['color'][i]))
+
+        # Shapes have to be added while the merged body does not have the scale of the foundation.
+        self.merged.detach_node()
+
+        for i in np.flatnonzero(states.awake[:n] & alive & ~awake):
+            block = states.blocks[i]
+            block.set_pos_quat(Point3(*records['pos'][i].tolist()), Quat(*records['quat'][i].tolist()))
+            self.settle(block)
+
+        for i in np.flatnonzero(~states.alive[:n] & alive):
+            block = self.revive(i)
+            block.set_pos_quat(Point3(*records['pos'][i].tolist()), Quat(*records['quat'][i].tolist()))
+
+            if awake[i]:
+                self.activate(block, Colors(records['color'][i]))
+            else:
+                self.instances[block.get_name()].write(block)
+                self.merge(block)
+
+        self.merged.reparent_to(self.blocks)
+        # Moving the body in the scene graph activates it, which would let it be chosen as a block.
+        self.merged.node().set_active(False, True)
+        if self.merged_shapes and self.merged.node() not in self.world.get_rigid_bodies():
+            self.world.attach(self.merged.node())
+
+        for i in np.flatnonzero(awake):
+            pos, quat, linear, angular, mass, color, flags = records[i].tolist()
+            block = states.blocks[i]
+            block.set_pos_quat(Point3(*pos.tolist()), Quat(*quat.tolist()))
+            nd = block.node()
+            nd.set_mass(mass)
+            nd.set_linear_velocity(Vec3(*linear.tolist()))
+            nd.set_angular_velocity(Vec3(*angular.tolist()))
+            nd.set_active(bool(flags & ACTIVE), True)
+
+            # the block may have been activated with another color after the snapshot.
+            if (info := self.block_index[nd])[2] != color:
+                self.block_index[nd] = (*info[:2], Colors(color))
+                self.instances[block.get_name()].set_color(block, Colors(color).rgba)
+
+        states.load(records['pos'], records['quat'], records['color'])
+        self.tower_top = snapshot.tower_top
+        self.inactive_top = snapshot.inactive_top
+        self.floater.set_z(snapshot.floater_z)
+        self.revision += 1
+        self.sync()
+        return snapshot
 
     def clean_up(self, block):
-        """block (NodePath)
+        """Take the block out of the game and stop drawing it at once;
+           its body is removed from the world later by remove_queued.
+           block (NodePath)
         """
-        self.world.remove(block.node())
-        block.remove_node()
+        if (info := self.block_index.pop(block.node(), None)) is None:
+            return
+
+        row, col, _ = info
+        self.table[row][col] = None
+        self.row_counts[row] -= 1
+        self.states.kill(block)
+        self.instances[block.get_name()].remove(block)
+        self.revision += 1
+
+        if self.unmerge(block):
+            block.remove_node()
+        else:
+            self.awake.discard(block)
+            # Rays and the other blocks pass through it until it is removed.
+            block.node().set_into_collide_mask(BitMask32.all_off())
+            self.removals.append(block)
+
+    def remove_blocks(self, blocks):
+        """Clean up a batch of blocks.
+        """
+        for block in blocks:
+            self.clean_up(block)
 
-    def get_neighbors(self, block, color, blocks):
-        blocks.append(block)
+    def remove_queued(self, budget=None, limit=None):
+        """Remove the cleaned up blocks from the world until the budget runs out;
+           at least one block is removed a call. Return the number of the removed blocks.
+           Args:
+                budget (float): seconds; if None, block-removal-budget is used; if 0, all blocks are removed;
+                limit (int): if given, the number of blocks to be removed instead of the budget;
+        """
+        budget = removal_budget.get_value() if budget is None else budget
+        start = time.perf_counter()
+        removed = 0
+
+        while self.removals:
+            block = self.removals.popleft()
+            self.world.remove(block.node())
+            block.remove_node()
+            removed += 1
+
+            if limit is not None:
+                if removed >= limit:
+                    break
+            elif budget and time.perf_counter() - start >= budget:
+                break
+
+        return removed
+
+    def get_adjacency(self):
+        """Return a dict mapping a block node to the block nodes touching it,
+           read from the persistent contact manifolds of the world.
+        """
+        adjacency = {}
 
-        for con in self.world.contact_test(block.node(), use_filter=True).get_contacts():
-            if (neighbor_nd := con.get_node1()) != self.foundation.node():
-                neighbor = NodePath(neighbor_nd)
-                if neighbor not in blocks and neighbor.get_color() == color:
-                    self.get_neighbors(neighbor, color, blocks)
+        for manifold in self.world.get_manifolds():
+            if manifold.get_num_manifold_points() == 0:
+                continue
+
+            nd0 = manifold.get_node0()
+            nd1 = manifold.get_node1()
+            if nd0 in self.block_index and nd1 in self.block_index:
+                adjacency.setdefault(nd0, []).append(nd1)
+                adjacency.setdefault(nd1, []).append(nd0)
+
+        return adjacency
+
+    def get_neighbors(self, block, color):
+        """Return a list of the blocks connected to the block through blocks of the same color.
+           Args:
+                color (Colors): color id
+           The adjacency is built once, so the cost is O(contact manifolds + contacts in the cluster).
+        """
+        adjacency = self.get_adjacency()
+        start = block.node()
+        visited = {start}
+        queue = deque([start])
+        blocks = []
+
+        while queue:
+            nd = queue.popleft()
+            blocks.append(NodePath(nd))
+
+            for neighbor_nd in adjacency.get(nd, []):
+                if neighbor_nd not in visited:
+                    visited.add(neighbor_nd)
+                    if self.block_index[neighbor_nd][2] == color:
+                        queue.append(neighbor_nd)
+
+        return blocks
 
     def judge_colors(self, judge_color):
-        """Args:
-                judge_color: lambda
+        """Return the activated blocks of the colors for which judge_color returns True.
+           Args:
+                judge_color: lambda taking a color id
         """
-        for block in self.blocks.get_children():
-            if block.node().is_active() and judge_color(block):
-                yield block
+        colors = [color for color in Colors if color != Colors.GRAY and judge_color(color)]
+        return self.states.find_colors(colors)
 
     def remove_all_blocks(self):
-        for block in self.blocks.get_children():
-            self.clean_up(block)
+        for row in self.table:
+            for block in row:
+                if block is not None:
+                    self.clean_up(block)
+        self.remove_queued(0)
+
+        for instances in self.instances.values():
+            instances.remove_node()
+        self.instances.clear()
+
+        self.merged.remove_node()
 
     def clear_foundation(self, bubbles):
         result = self.world.contact_test(self.foundation.node())
 
         for con in result.get_contacts():
             block = NodePath(con.get_node1())
-            bubbles.get_sequence(block.get_color(), block.get_pos()).start()
-            self.clean_up(block)
+            if (color := self.get_color(block)) is not None:
+                bubbles.get_sequence(color.rgba, block.get_pos()).start()
+                self.clean_up(block)
 
 
 class RegisteredTower(Tower):
@@ -172,8 +584,8 @@ class TwinTower(RegisteredTower):
     def __init__(self, rows, foundation, world):
         super().__init__(world, rows, 7, foundation, Point3(0, 0, 1.075))
         self.cylinders = {
-            'normal': Cylinder('normal', Vec3(0.1, 0.1, 0.15)),
-            'wide': Cylinder('wide', Vec3(0.25, 0.25, 0.15))
+            'normal': Cylinder('normal', Vec3(0.1, 0.1, 0.15), type(self).__name__, self.blocks),
+            'wide': Cylinder('wide', Vec3(0.25, 0.25, 0.15), type(self).__name__, self.blocks)
         }
 
         self.block_h = 0.15
@@ -219,10 +631,9 @@ class TwinTower(RegisteredTower):
             z = self.block_h * i
             for j, (pt, cylinder_type) in enumerate(self.block_position(i % 2 == 0, z)):
                 cylinder = self.cylinders[cylinder_type].copy_to(self.blocks)
-                cylinder.set_name(str(i * self.cols + j))
-                cylinder.set_color(Colors.GRAY.rgba)
                 cylinder.set_pos(pt)
-                self.attach_block(cylinder)
+                self.attach_block(cylinder, i, j)
+            yield
 
 
 class ThinTower(RegisteredTower):
@@ -231,8 +642,8 @@ class ThinTower(RegisteredTower):
 
     def __init__(self, rows, foundation, world):
         super().__init__(world, rows, 7, foundation, Point3(0, 0, 1.075))
-        self.half_rect = Cube('small_rect', Vec3(0.075, 0.075, 0.15))
-        self.normal_rect = Cube('big_rect', Vec3(0.15, 0.075, 0.15))
+        self.half_rect = Cube('small_rect', Vec3(0.075, 0.075, 0.15), type(self).__name__, self.blocks)
+        self.normal_rect = Cube('big_rect', Vec3(0.15, 0.075, 0.15), type(self).__name__, self.blocks)
 
         self.block_h = 0.15
         self.edge = 0.15
@@ -248,10 +659,9 @@ class ThinTower(RegisteredTower):
                 pos = Point3(self.edge * pt, 0, z)
                 rect = self.half_rect.copy_to(self.blocks) if i % 2 and j in {3, 6} \
                     else self.normal_rect.copy_to(self.blocks)
-                rect.set_name(str(i * self.cols + j))
-                rect.set_color(Colors.GRAY.rgba)
                 rect.set_pos(pos)
-                self.attach_block(rect)
+                self.attach_block(rect, i, j)
+            yield
 
 
 class CylinderTower(RegisteredTower):
@@ -260,7 +670,7 @@ class CylinderTower(RegisteredTower):
 
     def __init__(self, rows, foundation, world):
         super().__init__(world, rows, 18, foundation, Point3(0, 0, 1.075))
-        self.cylinder = Cylinder('cylinder', Vec3(0.1, 0.1, 0.15))
+        self.cylinder = Cylinder('cylinder', Vec3(0.1, 0.1, 0.15), type(self).__name__, self.blocks)
         self.block_h = 0.15
         self.radius = 0.29
         self.pts2d_even = [(x, y) for x, y in self.block_position(0, 360, 20)]
@@ -286,10 +696,9 @@ class CylinderTower(RegisteredTower):
             for j, (x, y) in enumerate(points):
                 pt = Point3(x, y, z)
                 cylinder = self.cylinder.copy_to(self.blocks)
-                cylinder.set_name(str(i * self.cols + j))
-                cylinder.set_color(Colors.GRAY.rgba)
                 cylinder.set_pos(pt)
-                self.attach_block(cylinder)
+                self.attach_block(cylinder, i, j)
+            yield
 
 
 class TripleTower(RegisteredTower):
@@ -300,8 +709,8 @@ class TripleTower(RegisteredTower):
         super().__init__(world, rows, 12, foundation, Point3(0, 0, 1.075))
 
         self.prisms = {
-            'normal': TriangularPrism('normal', Vec3(0.15, 0.15, 0.15)),
-            'wide': TriangularPrism('wide', Vec3(0.3, 0.3, 0.15))
+            'normal': TriangularPrism('normal', Vec3(0.15, 0.15, 0.15), type(self).__name__, self.blocks),
+            'wide': TriangularPrism('wide', Vec3(0.3, 0.3, 0.15), type(self).__name__, self.blocks)
         }
 
         self.block_h = 0.15  # 2.2  # 2.23
@@ -327,15 +736,14 @@ class TripleTower(RegisteredTower):
 
             for j, (center, (x, y)) in enumerate(itertools.product(self.centers, points)):
                 prism = self.prisms[prism_type].copy_to(self.blocks)
-                prism.set_name(str(i * self.cols + j))
-                prism.set_color(Colors.GRAY.rgba)
                 pos = Point3(x, y, z) + center
 
                 if i % 2 and not j % 4:
                     prism.set_h(180)
 
                 prism.set_pos(pos)
-                self.attach_block(prism)
+                self.attach_block(prism, i, j)
+            yield
 
 
 class CubicTower(RegisteredTower):
@@ -346,10 +754,10 @@ class CubicTower(RegisteredTower):
         super().__init__(world, rows, 12, foundation, Point3(0, 0, 1.075))
 
         self.rects = {
-            'normal': Cube('normal', Vec3(0.15, 0.15, 0.15)),
-            'short': Cube('short', Vec3(0.099, 0.15, 0.15)),
-            'large': Cube('large', Vec3(0.219, 0.219, 0.15)),
-            'long': Cube('long', Vec3(0.223, 0.15, 0.15))
+            'normal': Cube('normal', Vec3(0.15, 0.15, 0.15), type(self).__name__, self.blocks),
+            'short': Cube('short', Vec3(0.099, 0.15, 0.15), type(self).__name__, self.blocks),
+            'large': Cube('large', Vec3(0.219, 0.219, 0.15), type(self).__name__, self.blocks),
+            'long': Cube('long', Vec3(0.223, 0.15, 0.15), type(self).__name__, self.blocks)
         }
         self.block_h = 0.15
         self.edge = 0.075
@@ -370,11 +778,10 @@ class CubicTower(RegisteredTower):
             for j, (x, y, rect_type, h) in enumerate(pts):
                 pt = Point3(x * self.edge, y * self.edge, z)
                 rect = self.rects[rect_type].copy_to(self.blocks)
-                rect.set_name(str(i * self.cols + j))
-                rect.set_color(Colors.GRAY.rgba)
                 rect.set_pos(pt)
                 rect.set_h(h)
-                self.attach_block(rect)
+                self.attach_block(rect, i, j)
+            yield
 
 
 class HShapedTower(RegisteredTower):
@@ -386,8 +793,8 @@ class HShapedTower(RegisteredTower):
         self.block_h = 0.15
         self.edge = 0.075
         self.rects = {
-            'normal': Cube('normal', Vec3(0.15, 0.075, 0.15)),
-            'large': Cube('large', Vec3(0.1875, 0.075, 0.15))
+            'normal': Cube('normal', Vec3(0.15, 0.075, 0.15), type(self).__name__, self.blocks),
+            'large': Cube('large', Vec3(0.1875, 0.075, 0.15), type(self).__name__, self.blocks)
         }
 
         self.even_row = [
@@ -407,11 +814,10 @@ class HShapedTower(RegisteredTower):
             for j, (x, y, rect_type, h) in enumerate(cols):
                 pt = Point3(x * self.edge, y * self.edge, z)
                 rect = self.rects[rect_type].copy_to(self.blocks)
-                rect.set_name(str(i * self.cols + j))
-                rect.set_color(Colors.GRAY.rgba)
                 rect.set_pos(pt)
                 rect.set_h(h)
-                self.attach_block(rect)
+                self.attach_block(rect, i, j)
+            yield
 
 
 class CrossTower(RegisteredTower):
@@ -424,9 +830,9 @@ class CrossTower(RegisteredTower):
         self.edge = 0.15
 
         self.rects = {
-            'normal': Cube('normal', Vec3(0.15, 0.15, 0.15)),
-            'large': Cube('large', Vec3(0.219, 0.219, 0.15)),
-            'long': Cube('long', Vec3(0.223, 0.15, 0.15))
+            'normal': Cube('normal', Vec3(0.15, 0.15, 0.15), type(self).__name__, self.blocks),
+            'large': Cube('large', Vec3(0.219, 0.219, 0.15), type(self).__name__, self.blocks),
+            'long': Cube('long', Vec3(0.223, 0.15, 0.15), type(self).__name__, self.blocks)
         }
         self.even_row = [
             (0, 0, 'normal', 0), (-1, 0, 'normal', 0), (-2, 0, 'normal', 0), (1, 0, 'normal', 0), (2, 0, 'normal', 0),
@@ -442,51 +848,82 @@ class CrossTower(RegisteredTower):
             for j, (x, y, rect_type, h) in enumerate(points):
                 pt = Point3(x * self.edge, y * self.edge, z)
                 rect = self.rects[rect_type].copy_to(self.blocks)
-                rect.set_name(str(i * self.cols + j))
-                rect.set_color(Colors.GRAY.rgba)
                 rect.set_pos(pt)
                 rect.set_h(h)
-                self.attach_block(rect)
+                self.attach_block(rect, i, j)
+            yield
 
 
 class Cylinder(NodePath):
-
-    def __init__(self, name, scale):
+    """The prototype of cylinder blocks.
+       Args:
+            name (str)
+            scale (Vec3)
+            owner (str): the user of the shared geom and shape;
+            parent (NodePath): where the copies are put;
+    """
+
+    def __init__(self, name, scale, owner=None, parent=None):
         super().__init__(BulletRigidBodyNode(name))
-        self.cylinder = CylinderGeom()
+        # The body is put under the parent of its copies before it has the shape: Bullet scales a shared shape
+        # by the net scale of the body it is added to, and scaling it back and forth changes its size by
+        # rounding errors, which would make a tower fall differently for having been built before.
+        if parent is not None:
+            self.reparent_to(parent)
+            self.stash()
+        self.cylinder = prototypes.get_model(CylinderGeom, owner)
         self.cylinder.set_transform(TransformState.make_pos(Vec3(0, 0, -0.5)))
         end, tip = self.cylinder.get_tight_bounds()
-        self.node().add_shape(BulletCylinderShape((tip - end) / 2))
+        shape = prototypes.get_shape(
+            'cylinder', scale, lambda: BulletCylinderShape((tip - end) / 2), owner)
+        self.set_scale(scale)
+        self.node().add_shape(shape)
         self.set_collide_mask(BitMask32.bit(1) | BitMask32.bit(2) | BitMask32.bit(4))
         self.node().set_mass(1)
-        self.set_scale(scale)
         self.cylinder.reparent_to(self)
 
 
 class Cube(NodePath):
+    """The prototype of box blocks; the arguments are the same as Cylinder.
+    """
 
-    def __init__(self, name, scale):
+    def __init__(self, name, scale, owner=None, parent=None):
         super().__init__(BulletRigidBodyNode(name))
-        self.cube = CubeGeom()
+        self.cube = prototypes.get_model(CubeGeom, owner)
         end, tip = self.cube.get_tight_bounds()
-        self.node().add_shape(BulletBoxShape((tip - end) / 2))
+        shape = prototypes.get_shape(
+            'cube', scale, lambda: BulletBoxShape((tip - end) / 2), owner)
+        if parent is not None:
+            self.reparent_to(parent)
+            self.stash()
+        self.set_scale(scale)
+        self.node().add_shape(shape)
         self.set_collide_mask(BitMask32.bit(1) | BitMask32.bit(2) | BitMask32.bit(4))
         self.node().set_mass(1)
-        self.set_scale(scale)
         self.cube.reparent_to(self)
 
 
 class TriangularPrism(NodePath):
+    """The prototype of prism blocks; the arguments are the same as Cylinder.
+    """
 
-    def __init__(self, name, scale):
+    def __init__(self, name, scale, owner=None, parent=None):
         super().__init__(BulletRigidBodyNode(name))
-        self.prism = TriangularPrismGeom()
-        shape = BulletConvexHullShape()
-        geom = self.prism.node().get_geom(0)
-        shape.add_geom(geom, TransformState.makeScale(scale * 0.98))
+        self.prism = prototypes.get_model(TriangularPrismGeom, owner)
+        shape = prototypes.get_shape(
+            'prism', scale, lambda: self.make_hull(scale), owner)
 
+        if parent is not None:
+            self.reparent_to(parent)
+            self.stash()
         self.node().add_shape(shape)
         self.set_collide_mask(BitMask32.bit(1) | BitMask32.bit(2) | BitMask32.bit(4))
         self.node().set_mass(1)
         self.prism.set_scale(scale)
-        self.prism.reparent_to(self)
\ No newline at end of file
+        self.prism.reparent_to(self)
+
+    def make_hull(self, scale):
+        shape = BulletConvexHullShape()
+        geom = self.prism.get_child(0).node().get_geom(0)
+        shape.add_geom(geom, TransformState.makeScale(scale * 0.98))
+        return shape
@@ -1,18 +1,26 @@
 import sys
+import time
 from enum import Enum, auto
 
 from direct.gui.DirectGui import OnscreenText, Plain
 from direct.showbase.ShowBaseGlobal import globalClock
 from direct.showbase.ShowBase import ShowBase
 from panda3d.bullet import BulletWorld, BulletDebugNode
-from panda3d.core import NodePath, TextNode
+from panda3d.core import NodePath, TextNode, Camera, PerspectiveLens, MouseWatcher
 from panda3d.core import load_prc_file_data
 from panda3d.core import Vec3, BitMask32, Point3
 
 from balls import ColorBall
+from governor import QualityGovernor, governor_enabled
+from instrument import stage_timer, RateCounter
+from physics import PhysicsScheduler
+from prototypes import prototypes
 from lights import BasicAmbientLight, BasicDayLight
 from scene import Scene
+from session import SessionRecorder, CLICK, ROTATE, UNDO, REWIND
+from snapshot import SnapshotRing
 from start_screen import StartScreen
+from telemetry import Telemetry
 from tower import towers
 
 
@@ -53,26 +61,48 @@ class TowerCrash(ShowBase):
     def __init__(self):
         super().__init__()
         self.disable_mouse()
+
+        if self.win is None:
+            # Without a window (window-type none), a camera is still needed to choose blocks.
+            self.camera = self.render.attach_new_node('camera')
+            self.camLens = PerspectiveLens()
+            self.camLens.set_aspect_ratio(4 / 3)
+            self.cam = self.camera.attach_new_node(Camera('cam', self.camLens))
+            self.mouseWatcherNode = MouseWatcher()
+
+        self.timer = stage_timer
+        self.culled = RateCounter()
+        self.telemetry = Telemetry.from_config()
+        self.frame_start = time.perf_counter()
         self.camera_lowest_z = 2.5
         self.wait_count = 5
         self.tower_num = 0
-
-        self.world = BulletWorld()
-        self.world.set_gravity(Vec3(0, 0, -9.81))
+        self.tower = None
+        self.next_tower = None
+        # the snapshot taken before the last throw, and the ones kept while the tower is moving.
+        self.throw_snapshot = None
+        self.snapshots = SnapshotRing.from_config()
+        # the calls given by the keys, made by the next update while playing, as a click is.
+        self.commands = []
+        self.session_recorder = SessionRecorder.from_config()
+        # the number of blocks removed from the world in the next frame, given by a replay; None uses the time budget.
+        self.removal_limit = None
+
+        # Every tower is played in a new world made by create_world.
+        self.world = None
         self.debug = self.render.attach_new_node(BulletDebugNode('debug'))
-        self.world.set_debug_node(self.debug.node())
 
         self.ambient_light = BasicAmbientLight()
         self.directional_light = BasicDayLight()
 
-        self.scene = Scene(self.world)
+        self.scene = Scene()
         self.scene.reparent_to(self.render)
 
         self.navigator = NodePath('navigator')
         self.navigator.reparent_to(self.render)
         self.camera.reparent_to(self.navigator)
 
-        self.ball = ColorBall(self.world)
+        self.ball = ColorBall()
         self.ball_number_display = BallNumberDisplay()
 
         self.start_screen = StartScreen()
@@ -81,10 +111,15 @@ class TowerCrash(ShowBase):
 
         self.accept('escape', sys.exit)
         self.accept('d', self.toggle_debug)
+        self.accept('u', self.request, [self.undo_throw])
+        self.accept('r', self.request, [self.rewind])
         self.accept('mouse1', self.mouse_click)
         self.accept('mouse1-up', self.mouse_release)
 
+        self.governor = QualityGovernor(self) if governor_enabled.get_value() else None
         self.taskMgr.add(self.update, 'update')
+        # after the intervals, so that the bubbles are counted in the same frame.
+        self.taskMgr.add(self.end_frame, 'end_frame', sort=40)
 
     def toggle_debug(self):
         if self.debug.is_hidden():
@@ -92,7 +127,29 @@ class TowerCrash(ShowBase):
         else:
             self.debug.hide()
 
-    def initialize_game(self):
+    def create_world(self):
+        """Make a new physics world for a tower, so that how the tower falls does not depend on the towers played before it.
+        """
+        if self.world is not None:
+            self.scene.detach(self.world)
+            self.ball.detach(self.world)
+
+        self.world = BulletWorld()
+        self.world.set_gravity(Vec3(0, 0, -9.81))
+        self.world.set_debug_node(self.debug.node())
+        self.scene.attach(self.world)
+        self.ball.attach(self.world)
+
+    def seed_tower(self):
+        """Seed the random module before a tower is built, if the session is recorded.
+        """
+        if self.session_recorder is not None:
+            self.session_recorder.new_seed()
+
+    def initialize_game(self, retry=False):
+        """Args:
+                retry (bool): if True, the tower is put back to its start by the snapshot instead of being built;
+        """
         self.state = None
         self.click = False
         self.dragging = False
@@ -101,9 +158,33 @@ class TowerCrash(ShowBase):
         if self.tower_num >= len(towers):
             self.tower_num = 0
 
-        tower = towers[self.tower_num]
-        self.tower = tower(24, self.scene.foundation, self.world)
-        self.tower.build()
+        with self.timer.measure('tower_build'):
+            if retry:
+                self.tower.restore(self.start_snapshot)
+            else:
+                retired = self.tower
+                self.create_world()
+
+                if (tower := self.take_next_tower()) is not None:
+                    self.tower = tower
+                    self.tower.start()
+                else:
+                    self.seed_tower()
+                    tower = towers[self.tower_num]
+                    self.tower = tower(24, self.scene.foundation, self.world)
+                    self.tower.build()
+
+                if retired is not None:
+                    # the prototypes are kept while the same tower class is played again.
+                    if type(retired) is not type(self.tower):
+                        prototypes.release(type(retired).__name__)
+                    # its instanced geoms and merged body are under it.
+                    retired.remove_all_blocks()
+                    retired.remove_node()
+
+                if self.session_recorder is not None:
+                    self.session_recorder.begin(self.tower_num, self.tower)
+        self.physics = PhysicsScheduler(self.world, self.tower.keep_previous)
 
         self.camera_highest_z = self.tower.floater.get_z(self.render)
         self.navigator.set_pos_hpr(Point3(0, 0, self.camera_lowest_z), Vec3(0, 0, 0))
@@ -113,9 +194,76 @@ class TowerCrash(ShowBase):
         self.ball.initialize(self.tower)
         self.ball_cnt = self.tower.level
 
-    def setup_ball(self):
+        if not retry:
+            self.start_snapshot = self.snapshot()
+        self.throw_snapshot = None
+        self.snapshots.clear()
+
+    def prepare_next_tower(self):
+        """Build the next tower a row per frame while the start screen is fading in.
+           The tower is hidden and has nothing in the world until it is taken by initialize_game.
+           A tower not broken is retried from its start snapshot, so nothing is built.
+        """
+        if self.tower.tower_top > 1:
+            return
+
+        if (tower_num := self.tower_num + 1) >= len(towers):
+            tower_num = 0
+
+        self.seed_tower()
+        tower = towers[tower_num](24, self.scene.foundation, self.world)
+        tower.hide()
+        steps = tower.build_steps()
+        self.next_tower = (tower_num, tower, steps)
+        self.taskMgr.add(self.build_next_tower, 'build_next_tower', extraArgs=[steps], appendTask=True)
+
+    def build_next_tower(self, steps, task):
+        try:
+            with self.timer.measure('tower_build'):
+                next(steps)
+        except StopIteration:
+            return task.done
+        return task.cont
+
+    def drop_next_tower(self):
+        """Stop building the next tower in the background, and remove it.
+        """
+        if self.next_tower is None:
+            return
+
+        _, tower, _ = self.next_tower
+        self.next_tower = None
+        self.taskMgr.remove('build_next_tower')
+        tower.remove_node()
+
+        if type(tower) is not type(self.tower):
+            prototypes.release(type(tower).__name__)
+
+    def take_next_tower(self):
+        """Return the tower built in the background if it is the one to be played, otherwise None.
+        """
+        if self.next_tower is None:
+            return None
+
+        # The tower top can go down during the fade, which changes the tower to be played.
+        if self.next_tower[0] != self.tower_num:
+            self.drop_next_tower()
+            return None
+
+        tower_num, tower, steps = self.next_tower
+        self.next_tower = None
+        self.taskMgr.remove('build_next_tower')
+
+        # finish the rows left if the fade was shorter than the building.
+        for _ in steps:
+            pass
+        tower.world = self.world
+        tower.show()
+        return tower
+
+    def setup_ball(self, kind=None):
         start_pos = Point3(0, -60, -0.8)
-        self.ball.setup(start_pos, self.navigator)
+        self.ball.setup(start_pos, self.navigator, kind)
 
         # show the number of throwing a ball.
         self.ball_number_display.reparent_to(self.aspect2d)
@@ -140,22 +288,43 @@ class TowerCrash(ShowBase):
 
         return True
 
-    def choose_block(self, mouse_pos):
+    def get_ray(self, mouse_pos):
+        """Return the points the mouse position is extruded to in render coordinates.
+        """
         near_pos = Point3()
         far_pos = Point3()
         self.camLens.extrude(mouse_pos, near_pos, far_pos)
 
         from_pos = self.render.get_relative_point(self.cam, near_pos)
         to_pos = self.render.get_relative_point(self.cam, far_pos)
+        return from_pos, to_pos
+
+    def choose_block(self, from_pos, to_pos):
         result = self.world.ray_test_closest(from_pos, to_pos, BitMask32.bit(1))
 
         if result.hasHit():
-            if (nd := result.get_node()).is_active():
+            # only the blocks of the tower can be aimed at, not the merged body of the inactive rows.
+            if (nd := result.get_node()).is_active() and nd in self.tower.block_index:
                 clicked_pt = result.get_hit_pos()
                 block = NodePath(nd)
                 self.ball.aim_at(clicked_pt, block)
                 return True
 
+    def throw_ball(self, from_pos, to_pos):
+        """Throw the ball at the block hit by the ray, and return True if there is one.
+        """
+        with self.timer.measure('choose_block'):
+            chosen = self.choose_block(from_pos, to_pos)
+
+        if chosen:
+            if self.session_recorder is not None:
+                self.session_recorder.record(CLICK, self.navigator.get_h(), from_pos, to_pos)
+            self.throw_snapshot = self.snapshot()
+            self.ball_number_display.detach_node()
+            self.ball_cnt -= 1
+            self.state = Game.THROW
+            return True
+
     def mouse_click(self):
         self.dragging = True
         self.dragging_start_time = globalClock.get_frame_time()
@@ -181,30 +350,97 @@ class TowerCrash(ShowBase):
         self.navigator.set_h(self.navigator.get_h() + angle)
         self.before_mouse_x = mouse_x
 
+        if angle and self.session_recorder is not None:
+            self.session_recorder.record(ROTATE, self.navigator.get_h())
+
     def move_down_camera(self, dt):
         if self.navigator.get_z() > self.camera_lowest_z:
             distance = 10 * dt
             self.navigator.set_z(self.navigator.get_z() - distance)
 
-    def _start(self, task):
-        self.state = Game.READY
-        return task.done
+    def snapshot(self):
+        """Return the state of the tower and the balls as bytes; the ball in hand is kept only while playing.
+        """
+        return self.tower.snapshot(
+            ball_cnt=self.ball_cnt,
+            ball_kind=self.ball.kind if self.state == Game.PLAY else -1,
+            twotone_used=self.ball.twotone_used
+        )
 
-    def start_new_game(self):
-        self.initialize_game()
-        self.taskMgr.do_method_later(3, self._start, 'start')
+    def restore(self, data):
+        """Put the tower and the balls back to the snapshot, and go on playing from it.
+        """
+        snapshot = self.tower.restore(data)
+        self.physics.reset()
+        self.ball_cnt = snapshot.ball_cnt
+        self.ball.twotone_used = snapshot.twotone_used
+        self.setup_ball(snapshot.ball_kind if snapshot.ball_kind >= 0 else None)
+        self.state = Game.PLAY
+
+    def request(self, command):
+        """Have the next update call the command while playing, at the same point of the frame as a click.
+           Commands given in other states are dropped.
+        """
+        self.commands.append(command)
+
+    def undo_throw(self):
+        """Put the tower back to just before the last throw.
+        """
+        if self.state == Game.PLAY and self.throw_snapshot is not None:
+            with self.timer.measure('restore'):
+                self.restore(self.throw_snapshot)
+            self.throw_snapshot = None
+
+            if self.session_recorder is not None:
+                self.session_recorder.record(UNDO)
+
+    def rewind(self):
+        """Put the tower back to the newest snapshot kept while it was moving; repeat to go further back.
+        """
+        if self.state == Game.PLAY and (data := self.snapshots.pop()) is not None:
+            with self.timer.measure('restore'):
+                self.restore(data)
+
+            if self.session_recorder is not None:
+                self.session_recorder.record(REWIND)
+
+    def start_new_game(self, retry=False):
+        self.initialize_game(retry)
+        # counted down by the frame time in update, so that a replayed session starts at the same frame.
+        self.start_delay = 3
+
+    def clean_sea_bottom(self, dt):
+        """Remove the blocks which have fallen to the sea bottom, judged by their height.
+        """
+        fallen = self.tower.find_fallen(self.scene.bottom.get_level(self.tower.blocks))
+        self.tower.remove_blocks(fallen)
+        self.culled.add(len(fallen), dt)
+
+    def end_frame(self, task):
+        stages = self.timer.end_frame()
+        now = time.perf_counter()
+        frame_time = now - self.frame_start
+        self.frame_start = now
+
+        if self.telemetry is not None:
+            self.telemetry.record(self, globalClock.get_dt(), frame_time, stages)
+        if self.governor is not None:
+            self.governor.update(frame_time)
 
-    def clean_sea_bottom(self):
-        for con in self.world.contact_test(self.scene.bottom.node()).get_contacts():
-            block = NodePath(con.get_node0())
-            self.tower.clean_up(block)
+        return task.cont
 
     def update(self, task):
         dt = globalClock.getDt()
-        self.scene.water_camera.setMat(
-            self.cam.getMat(self.render) * self.scene.clip_plane.getReflectionMat())
+
+        if self.session_recorder is not None:
+            self.session_recorder.tick(dt, self.tower.states.alive)
 
         match self.state:
+            case None:
+                self.start_delay -= dt
+                if self.start_delay <= 0:
+                    self.state = Game.READY
+
             case Game.READY:
                 if self.start_screen.disappear(dt):
                     self.start_screen.tear_down()
@@ -219,18 +455,22 @@ class TowerCrash(ShowBase):
                 if self.start_screen.appear(dt):
                     if self.tower.tower_top <= 1:
                         self.tower_num += 1
-                    self.tower.remove_all_blocks()
-                    self.start_new_game()
+                        self.tower.remove_all_blocks()
+                        self.start_new_game()
+                    else:
+                        self.start_new_game(retry=True)
+                    # The tower starts from the next frame, as it does when a session is replayed.
+                    return task.cont
 
             case Game.PLAY:
+                for command in self.commands:
+                    command()
+
                 if self.mouseWatcherNode.has_mouse():
                     mouse_pos = self.mouseWatcherNode.get_mouse()
 
                     if self.click:
-                        if self.choose_block(mouse_pos):
-                            self.ball_number_display.detach_node()
-                            self.ball_cnt -= 1
-                            self.state = Game.THROW
+                        self.throw_ball(*self.get_ray(mouse_pos))
                         self.click = False
 
                     if self.dragging:
@@ -238,11 +478,14 @@ class TowerCrash(ShowBase):
                             self.rotate_camera(mouse_pos.x, dt)
 
             case Game.THROW:
-                if not self.ball.move(dt):
+                with self.timer.measure('ball_move'):
+                    moving = self.ball.move(dt)
+                if not moving:
                     self.state = Game.HIT
 
             case Game.HIT:
-                self.ball.hit()
+                with self.timer.measure('ball_hit'):
+                    self.ball.hit()
                 self.state = Game.JUDGE
 
             case Game.JUDGE:
@@ -251,15 +494,32 @@ class TowerCrash(ShowBase):
                     self.state = Game.PLAY
                 else:
                     self.start_screen.set_up()
+                    self.prepare_next_tower()
                     self.state = Game.GAMEOVER
 
-        self.tower.update()
-        self.clean_sea_bottom()
+        self.commands.clear()
+        with self.timer.measure('tower_update'):
+            self.tower.update()
+        with self.timer.measure('clean_sea_bottom'):
+            self.clean_sea_bottom(dt)
 
         if self.navigator.get_z() > self.tower.floater.get_z(self.render):
             self.move_down_camera(dt)
 
-        self.world.do_physics(dt)
+        with self.timer.measure('remove_queued'):
+            removed = self.tower.remove_queued(limit=self.removal_limit)
+        if self.tower.removals and self.session_recorder is not None:
+            self.session_recorder.record_queued(removed)
+        with self.timer.measure('do_physics'):
+            self.physics.step(dt)
+        self.tower.sync(self.physics.alpha)
+
+        # keep the collapse to be rewound; blocks at rest move far less than this.
+        # Only while playing: a snapshot in flight would hold the thrown ball's count but not its hit.
+        if self.state == Game.PLAY and self.tower.get_motion() > 1e-4:
+            with self.timer.measure('snapshot'):
+                self.snapshots.tick(self.snapshot)
+        self.scene.update_reflection(self.cam, self.tower, self.state == Game.THROW)
         return task.cont
 
 